@@ -0,0 +1,278 @@
+"""
+Benchmark dados_gov_br.py against a local fake ckan portal, resource hosts
+and ftp server: requests per second, wall time and peak rss per mode
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from pathlib import Path
+from time import monotonic, perf_counter
+from typing import Optional
+
+import servers
+
+SCRIPT = Path(__file__).resolve().parent.parent / "scripts" / "dados_gov_br.py"
+
+# Name, arguments, in the order they run, later modes read what earlier ones wrote
+MODES = [
+    ("api_show", ["api", "--mode", "show"]),
+    ("api_search", ["api", "--mode", "search"]),
+    ("api_list", ["api", "--mode", "list"]),
+    ("url", ["url"]),
+    ("uri_scheme", ["uri_scheme"]),
+    ("score", ["score"]),
+]
+COLUMNS = ("mode", "requests", "wall", "rps", "rss_mb", "status")
+
+
+def child(url_base: str, argv: list[str]) -> None:
+    """
+    Run one mode of the script in this process, against the fake portal
+
+    :param url_base: Fake portal api base url
+    :type url_base: str
+    :param argv: Script arguments
+    :type argv: list[str]
+    """
+
+    # Output directories derive from argv[0] at import
+    sys.argv[0] = SCRIPT.name
+    sys.path.insert(0, str(SCRIPT.parent))
+
+    import dados_gov_br
+
+    dados_gov_br.URL_BASE = url_base
+
+    logging.disable(logging.CRITICAL)
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        dados_gov_br.main(argv)
+
+
+def run(
+    argv: list[str], url_base: str, directory: str, counters: list[servers.Counter]
+) -> dict:
+    """
+    Run one mode in a child process, its rss apart from ours
+
+    :param argv: Script arguments
+    :type argv: list[str]
+    :param url_base: Fake portal api base url
+    :type url_base: str
+    :param directory: Working directory of the child
+    :type directory: str
+    :param counters: Counters of every server
+    :type counters: list[servers.Counter]
+    :return: requests, wall, rps, rss_mb and status
+    :rtype: dict
+    """
+
+    for _ in counters:
+        _.reset()
+
+    start = perf_counter()
+
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "child", url_base, *argv],
+        cwd=directory,
+    )
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    wall = perf_counter() - start
+    requests = sum(_.count for _ in counters)
+
+    return {
+        "requests": requests,
+        "wall": round(wall, 3),
+        "rps": round(requests / wall, 1) if wall else 0.0,
+        "rss_mb": round(rusage.ru_maxrss / 1024, 1),  # kB on linux
+        "status": process.returncode,
+    }
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare with a previous run
+
+    :param results: Results by mode
+    :type results: dict
+    :param baseline: Previous results by mode
+    :type baseline: dict
+    :param tolerance: Allowed relative change
+    :type tolerance: float
+    :return: What got worse
+    :rtype: list[str]
+    """
+
+    found = []
+
+    for mode, result in results.items():
+        if mode not in baseline:
+            continue
+        previous = baseline[mode]
+
+        if result["status"] != 0:
+            found.append(f"{mode}: exit status {result['status']}")
+        if result["wall"] > previous["wall"] * (1 + tolerance):
+            found.append(f"{mode}: wall {previous['wall']}s -> {result['wall']}s")
+        if previous["rps"] and result["rps"] < previous["rps"] * (1 - tolerance):
+            found.append(f"{mode}: rps {previous['rps']} -> {result['rps']}")
+        if result["rss_mb"] > previous["rss_mb"] * (1 + tolerance):
+            found.append(f"{mode}: rss {previous['rss_mb']}MB -> {result['rss_mb']}MB")
+
+    return found
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Command line
+
+    :param argv: Arguments, defaults to sys.argv
+    :type argv: Optional[list[str]], optional
+    :return: Exit status, 1 on a regression
+    :rtype: int
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--packages", type=int, default=100)
+    parser.add_argument("--resources", type=int, default=4, help="Per package")
+    parser.add_argument("--hosts", type=int, default=4, help="Resource hosts")
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds")
+    parser.add_argument("--latency-api", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--redirect-rate", type=float, default=0.05)
+    parser.add_argument(
+        "--storm", type=float, default=0.0, help="Seconds of every 10 answered 503"
+    )
+    parser.add_argument(
+        "--rate-host",
+        type=float,
+        default=0.0,
+        help="Passed to the check modes, 0 so they are measured unthrottled",
+    )
+    parser.add_argument(
+        "--ftp-share",
+        type=float,
+        default=0.1,
+        help="Share of resource urls on the ftp server, 0 for none",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=[_[0] for _ in MODES],
+        choices=[_[0] for _ in MODES],
+    )
+    parser.add_argument(
+        "--format",
+        default="csv",
+        choices=["csv", "parquet"],
+        help="Script output format",
+    )
+    parser.add_argument("--output", help="Write results as json")
+    parser.add_argument("--baseline", help="Results json to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+
+    args = parser.parse_args(argv)
+
+    behaviour = servers.Behaviour(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        redirect_rate=args.redirect_rate,
+        storm=args.storm,
+    )
+    counters = []
+    started = monotonic()
+
+    hosts = []
+    for _ in range(args.hosts):
+        counter = servers.Counter()
+        server = servers.serve(
+            f"{servers.HOST_BASE}.{_ + 2}",
+            servers.resource_handler(behaviour, counter, started),
+        )
+        hosts.append(f"http://{servers.HOST_BASE}.{_ + 2}:{server.server_address[1]}")
+        counters.append(counter)
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        ftp = None
+        if args.ftp_share:
+            counter = servers.Counter()
+            ftp_server = servers.ftp_serve(
+                f"{servers.HOST_BASE}.1", f"{directory}/ftp", counter
+            )
+            if ftp_server is not None:
+                ftp = (
+                    f"ftp://{servers.HOST_BASE}.1:{ftp_server.socket.getsockname()[1]}"
+                )
+                counters.append(counter)
+
+        portal = servers.Portal(
+            args.packages, args.resources, hosts, ftp, args.ftp_share
+        )
+        if ftp:
+            servers.ftp_files_write(f"{directory}/ftp", portal.ftp_files())
+
+        counter = servers.Counter()
+        server = servers.serve(
+            f"{servers.HOST_BASE}.1",
+            servers.portal_handler(portal, counter, args.latency_api),
+        )
+        url_base = f"http://{servers.HOST_BASE}.1:{server.server_address[1]}/api/3"
+        counters.append(counter)
+
+        os.makedirs(f"{directory}/work")
+
+        results = {}
+        for name, mode_argv in MODES:
+            if name not in args.modes:
+                continue
+            if name in ("url", "uri_scheme"):
+                mode_argv = [*mode_argv, "--rate-host", str(args.rate_host)]
+            results[name] = run(
+                [*mode_argv, "--format", args.format],
+                url_base,
+                f"{directory}/work",
+                counters,
+            )
+
+    print(" ".join(f"{_:>12}" for _ in COLUMNS))
+    for name, result in results.items():
+        print(f"{name:>12} " + " ".join(f"{result[_]:>12}" for _ in COLUMNS[1:]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if {
+            k: v
+            for k, v in baseline["config"].items()
+            if k not in ("output", "baseline")
+        } != {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}:
+            logging.error("Baseline ran with a different configuration")
+
+        found = regressions(results, baseline["results"], args.tolerance)
+        for _ in found:
+            logging.error(_)
+        if found:
+            return 1
+
+    return 0 if all(_["status"] == 0 for _ in results.values()) else 1
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["child"]:
+        child(sys.argv[2], sys.argv[3:])
+    else:
+        sys.exit(main())
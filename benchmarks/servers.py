@@ -0,0 +1,432 @@
+"""
+Local stand ins for the network dados_gov_br.py talks to:
+a ckan api, resource hosts and an ftp server, all counting what they serve
+"""
+
+import json
+import logging
+import os
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlsplit
+
+HOST_BASE = "127.0.0"  # Hosts are 127.0.0.2 on, so per host limits see them apart
+FTP_FILES_MISSING = 0.1  # Share of ftp resources not on the server
+
+
+class Counter:
+    """
+    Requests served, shared by a server's threads
+    """
+
+    __slots__ = ("_lock", "_count")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self._count}>"
+
+    def add(self) -> None:
+        with self._lock:
+            self._count += 1
+
+    def reset(self) -> int:
+        """
+        Zero the count
+
+        :return: Count before
+        :rtype: int
+        """
+
+        with self._lock:
+            count, self._count = self._count, 0
+        return count
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+
+class Behaviour:
+    """
+    How a resource host answers, decided per path so reruns see the same
+    """
+
+    __slots__ = ("latency", "error_rate", "redirect_rate", "storm", "period")
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        redirect_rate: float = 0.0,
+        storm: float = 0.0,
+        period: float = 10.0,
+    ):
+        """
+        :param latency: Seconds before answering, defaults to 0.0
+        :type latency: float, optional
+        :param error_rate: Share of paths answered 404 / 410, defaults to 0.0
+        :type error_rate: float, optional
+        :param redirect_rate: Share of paths redirected once, defaults to 0.0
+        :type redirect_rate: float, optional
+        :param storm: Seconds of every period everything gets 503 and Retry-After, defaults to 0.0
+        :type storm: float, optional
+        :param period: Storm period, defaults to 10.0
+        :type period: float, optional
+        """
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.redirect_rate = redirect_rate
+        self.storm = storm
+        self.period = period
+
+    def __repr__(self):
+        return (
+            f"<{type(self).__name__} latency={self.latency} error_rate={self.error_rate} "
+            f"redirect_rate={self.redirect_rate} storm={self.storm}/{self.period}>"
+        )
+
+
+def share(path: str, salt: str) -> float:
+    """
+    Stable value in [0, 1) for a path
+
+    :param path: Path
+    :type path: str
+    :param salt: Separates one use from another
+    :type salt: str
+    :return: Value
+    :rtype: float
+    """
+
+    return zlib.crc32(f"{salt}{path}".encode()) / 2**32
+
+
+def resource_handler(behaviour: Behaviour, counter: Counter, started: float) -> type:
+    """
+    Handler class for a resource host
+
+    :param behaviour: How to answer
+    :type behaviour: Behaviour
+    :param counter: Requests served
+    :type counter: Counter
+    :param started: When storms are timed from, monotonic
+    :type started: float
+    :return: Handler class
+    :rtype: type
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def answer(self, body: bool) -> None:
+
+            counter.add()
+
+            if behaviour.latency:
+                sleep(behaviour.latency)
+
+            path = urlsplit(self.path).path
+            status = 200
+            headers = {
+                "Content-Type": "text/csv",
+                "ETag": f'"{zlib.crc32(path.encode())}"',
+            }
+            content = b"id,value\n" + b"1,2\n" * 64
+
+            if (
+                behaviour.storm
+                and (monotonic() - started) % behaviour.period < behaviour.storm
+            ):
+                status = 503
+                headers = {"Retry-After": "1"}
+                content = b""
+            elif path.startswith("/r/"):
+                pass  # Redirected here
+            elif share(path, "error") < behaviour.error_rate:
+                status = 404 if share(path, "status") < 0.5 else 410  # Not retried
+                headers = {"Content-Type": "text/html"}
+                content = b"<html><body>Not here</body></html>"
+            elif share(path, "redirect") < behaviour.redirect_rate:
+                status = 302
+                headers = {"Location": f"/r{path}"}
+                content = b""
+
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+
+            if body:
+                self.wfile.write(content)
+
+        def do_HEAD(self) -> None:
+            self.answer(body=False)
+
+        def do_GET(self) -> None:
+            self.answer(body=True)
+
+    return Handler
+
+
+class Portal:
+    """
+    Fake ckan portal, packages with resources spread over the resource hosts
+    """
+
+    __slots__ = ("packages", "resources", "hosts", "ftp", "ftp_share", "malformed")
+
+    def __init__(
+        self,
+        packages: int,
+        resources: int,
+        hosts: list[str],
+        ftp: Optional[str] = None,
+        ftp_share: float = 0.1,
+        malformed: float = 0.02,
+    ):
+        """
+        :param packages: Packages
+        :type packages: int
+        :param resources: Resources per package
+        :type resources: int
+        :param hosts: Resource host base urls
+        :type hosts: list[str]
+        :param ftp: ftp base url, defaults to None, no ftp resources
+        :type ftp: Optional[str], optional
+        :param ftp_share: Share of resource urls on ftp, defaults to 0.1
+        :type ftp_share: float, optional
+        :param malformed: Share of resource urls that are malformed, defaults to 0.02
+        :type malformed: float, optional
+        """
+
+        self.packages = packages
+        self.resources = resources
+        self.hosts = hosts
+        self.ftp = ftp
+        self.ftp_share = ftp_share
+        self.malformed = malformed
+
+    def __repr__(self):
+        return f"<{type(self).__name__} packages={self.packages} resources={self.resources} hosts={len(self.hosts)}>"
+
+    def url(self, package: int, resource: int) -> str:
+
+        path = f"dataset/{package}/resource-{resource}.csv"
+        value = share(path, "url")
+
+        if value < self.malformed:
+            return f"htp:/broken {path}"
+
+        # ftp takes a slice of the urls, in a few directories
+        if self.ftp and value > 1 - self.ftp_share:
+            return f"{self.ftp}/dir{package % 8}/{package}-{resource}.csv"
+
+        return f"{self.hosts[package % len(self.hosts)]}/{path}"
+
+    def package(self, package: int) -> dict:
+        return {
+            "id": f"id-{package}",
+            "name": f"package-{package:06d}",
+            "license_title": "Creative Commons Attribution",
+            "license_id": "cc-by",
+            "maintainer": "Benchmark",
+            "extras": [],
+            "resources": [
+                {
+                    "id": f"id-{package}-{_}",
+                    "url": self.url(package, _),
+                    "format": "CSV",
+                    "name": f"resource-{_}",
+                    "state": "active",
+                }
+                for _ in range(self.resources)
+            ],
+        }
+
+    def ftp_files(self) -> list[str]:
+        """
+        Paths the ftp server should have, some left out
+
+        :return: Paths relative to the ftp root
+        :rtype: list[str]
+        """
+
+        files = []
+
+        for package in range(self.packages):
+            for resource in range(self.resources):
+                url = self.url(package, resource)
+                if url.startswith(str(self.ftp)):
+                    path = url[len(str(self.ftp)) + 1 :]
+                    if share(path, "missing") >= FTP_FILES_MISSING:
+                        files.append(path)
+
+        return files
+
+
+def portal_handler(portal: Portal, counter: Counter, latency: float = 0.0) -> type:
+    """
+    Handler class for the ckan api, package_list, package_show,
+    package_search and current_package_list_with_resources
+
+    :param portal: Packages
+    :type portal: Portal
+    :param counter: Requests served
+    :type counter: Counter
+    :param latency: Seconds before answering, defaults to 0.0
+    :type latency: float, optional
+    :return: Handler class
+    :rtype: type
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+
+            counter.add()
+
+            if latency:
+                sleep(latency)
+
+            parts = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            action = parts.path.rstrip("/").split("/")[-1]
+
+            status = 200
+            result: object = None
+
+            if action == "package_list":
+                result = [f"package-{_:06d}" for _ in range(portal.packages)]
+            elif action == "package_show":
+                try:
+                    result = portal.package(int(query.get("id", "").split("-")[-1]))
+                except ValueError:
+                    status = 404
+            elif action == "package_search":
+                start = int(query.get("start", 0))
+                rows = int(query.get("rows", 10))
+                result = {
+                    "count": portal.packages,
+                    "results": [
+                        portal.package(_)
+                        for _ in range(start, min(portal.packages, start + rows))
+                    ],
+                }
+            elif action == "current_package_list_with_resources":
+                offset = int(query.get("offset", 0))
+                limit = int(query.get("limit", 10))
+                result = [
+                    portal.package(_)
+                    for _ in range(offset, min(portal.packages, offset + limit))
+                ]
+            else:
+                status = 404
+
+            content = json.dumps({"success": status == 200, "result": result}).encode()
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return Handler
+
+
+def serve(host: str, handler: type) -> ThreadingHTTPServer:
+    """
+    Start a threaded http server on a free port
+
+    :param host: Address to bind
+    :type host: str
+    :param handler: Handler class
+    :type handler: type
+    :return: Server, serving in a daemon thread
+    :rtype: ThreadingHTTPServer
+    """
+
+    server = ThreadingHTTPServer((host, 0), handler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def ftp_files_write(root: str, files: list[str]) -> None:
+    """
+    Create the files an ftp server serves
+
+    :param root: Directory served
+    :type root: str
+    :param files: Paths under root
+    :type files: list[str]
+    """
+
+    for _ in files:
+        os.makedirs(os.path.dirname(os.path.join(root, _)), exist_ok=True)
+        with open(os.path.join(root, _), "w") as f:
+            f.write("id,value\n1,2\n")
+
+
+def ftp_serve(host: str, root: str, counter: Counter) -> Optional[Any]:
+    """
+    Start an anonymous ftp server on a free port, needs pyftpdlib
+
+    :param host: Address to bind
+    :type host: str
+    :param root: Directory served, created
+    :type root: str
+    :param counter: Logins and files sent
+    :type counter: Counter
+    :return: Server, serving in a daemon thread, None without pyftpdlib
+    :rtype: Optional[ThreadedFTPServer]
+    """
+
+    try:
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+    except ImportError:
+        logging.error("pyftpdlib not installed, no ftp server")
+        return None
+
+    # Its own logging setup is skipped when the logger has a handler
+    logging.getLogger("pyftpdlib").addHandler(logging.NullHandler())
+    logging.getLogger("pyftpdlib").propagate = False
+
+    os.makedirs(root, exist_ok=True)
+
+    class Handler(FTPHandler):
+        def on_login(self, username: str) -> None:
+            counter.add()
+
+        def on_file_sent(self, file: str) -> None:
+            counter.add()
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(root)
+    Handler.authorizer = authorizer
+
+    server = ThreadedFTPServer((host, 0), Handler)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
@@ -0,0 +1,97 @@
+"""
+Run any of the scripts, python -m scripts <command>.
+Only the chosen script is imported, and it imports its heavy dependencies
+only where used, so light jobs start quickly
+"""
+
+import argparse
+import importlib
+import sys
+from pathlib import Path
+from typing import Optional
+
+# Command: module, function, arguments forwarded after these, None takes none, help
+COMMANDS: dict[str, tuple[str, str, Optional[list[str]], str]] = {
+    "ckan-api": ("dados_gov_br", "main", ["api"], "Harvest the dados.gov.br ckan api"),
+    "ckan-check": (
+        "dados_gov_br",
+        "main",
+        [],
+        "Check resource urls, url, uri_scheme (default) or merge",
+    ),
+    "ckan-score": (
+        "dados_gov_br",
+        "main",
+        ["score"],
+        "Score availability from the checks",
+    ),
+    "falabr-fetch": (
+        "falabr_cgu_gov_br",
+        "get_data",
+        None,
+        "Download the FalaBR data and dictionaries",
+    ),
+    "falabr-eda": ("falabr_cgu_gov_br", "create_eda", None, "Profile the FalaBR data"),
+    "iana": (
+        "iana_org_assignments_media-types_media-types_xhtml",
+        "get_data",
+        None,
+        "IANA media types",
+    ),
+    "wikipedia-formats": (
+        "en_wikipedia_org_wiki_List_of_file_formats",
+        "get_data",
+        None,
+        "Wikipedia list of file formats",
+    ),
+    "ckan-extensions": (
+        "extensions_ckan_org",
+        "get_ckan",
+        None,
+        "ckan extensions with their github activity",
+    ),
+    "techsignatures": (
+        "_techsignatures",
+        "get_signatures",
+        None,
+        "Common href signatures across ckan sites",
+    ),
+}
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """
+    Command line
+
+    :param argv: Arguments, defaults to sys.argv
+    :type argv: Optional[list[str]], optional
+    """
+
+    parser = argparse.ArgumentParser(prog="python -m scripts", description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, (_, _, prefix, help_) in COMMANDS.items():
+        # Forwarding commands leave --help to the script
+        subparsers.add_parser(name, help=help_, add_help=prefix is None)
+
+    args, forwarded = parser.parse_known_args(argv)
+
+    module, function, prefix, _ = COMMANDS[args.command]
+
+    if prefix is None and forwarded:
+        parser.error(f"unrecognized arguments: {' '.join(forwarded)}")
+
+    # Scripts name their output directories after argv[0] at import,
+    # and shards respawn it, so it is the script's own path
+    sys.argv[0] = str(Path(__file__).resolve().parent / f"{module}.py")
+
+    run = getattr(importlib.import_module(f".{module}", __package__), function)
+
+    if prefix is None:
+        run()
+    else:
+        run(prefix + forwarded)
+
+
+if __name__ == "__main__":
+    main()
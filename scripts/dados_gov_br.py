@@ -4,26 +4,64 @@
 # TODO URL Fix suggestions - did you mean?
 # TODO Maybe add retries on FTP
 
+import argparse
+import asyncio
+import atexit
+import codecs
 import csv
 import ftplib
+import hashlib
 import json
 import logging
+import math
 import mimetypes
 import os
+import random
 import re
 import socket
+import subprocess
 import sys
+import threading
+from array import array
+from calendar import timegm
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import suppress
 from copy import deepcopy
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
 from http import HTTPStatus
 from pathlib import Path
-from time import sleep
-from typing import Optional, Union
+from time import monotonic, perf_counter, sleep, strftime, time
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Sequence,
+    SupportsIndex,
+    Union,
+    overload,
+)
+from urllib.parse import quote, unquote, urlsplit, urlunsplit
 
-import ftpparser
 import requests
+from requests.adapters import HTTPAdapter
 from requests.structures import CaseInsensitiveDict
-from uri import URI
-from yarl import URL  # TODO just use URI package buuut IDNA handling?
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+# ftpparser and yarl are imported where used, http only runs skip them
 
 logging.basicConfig(stream=sys.stdout, level=logging.ERROR)
 
@@ -33,6 +71,93 @@ DIRECTORY_MAPPING = f"mapping/{sys.argv[0].split('/')[-1]}"
 USER_AGENT: str = "dados.gov.br-ckan-validator"
 REQUEST_RETRIES_MAX = 4
 REQUEST_TIMEOUT = 15
+REQUEST_CONCURRENCY = 32  # In flight requests over all hosts
+REQUEST_CONCURRENCY_HOST = 4  # In flight requests per host, be polite
+REQUEST_WORKERS = 8  # package_show workers against the ckan api
+REQUEST_PAGE_SIZE = 1000  # Packages per page when harvesting in bulk
+REQUEST_RATE_HOST = (
+    5.0  # Requests per second per host, bursts up to REQUEST_CONCURRENCY_HOST
+)
+REQUEST_BACKOFF = 1.0  # First backoff, doubling per retry
+REQUEST_BACKOFF_MAX = 60.0
+REQUEST_RETRY_AFTER_MAX = 300.0  # Cap on honouring a host's Retry-After
+REQUEST_MAX_BYTES = 65536  # Body read by checker GETs, streamed and cut off
+REQUEST_CHUNK = 65536  # Streaming read size
+REQUEST_BREAKER_FAILURES = 5  # Consecutive connection failures before a host is skipped
+REQUEST_BREAKER_COOLDOWN = 300.0  # Seconds before a skipped host is probed again
+REQUEST_BREAKER_METHOD = "BREAKER"  # Method of skipped urls rows, never requested
+REQUEST_ERRORS_FINAL = (  # The url itself is at fault, retrying won't help
+    requests.exceptions.InvalidSchema,
+    requests.exceptions.InvalidURL,
+    requests.exceptions.MissingSchema,
+)
+SNIFF_BYTES = 4096  # Leading bytes asked for by a sniffing range GET
+SNIFF_STATUSES = (403, 405, 501)  # HEAD refused, though GET may not be
+MIME_TYPES_GENERIC = (  # Declared types that say nothing of the format
+    "application/octet-stream",
+    "binary/octet-stream",
+    "application/binary",
+    "application/download",
+    "application/force-download",
+    "application/x-download",
+    "application/unknown",
+    "text/plain",
+)
+MAGIC_BYTES = (  # Leading bytes, mime type
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),  # xls, doc
+    (b"\x1f\x8b", "application/gzip"),
+    (b"Rar!\x1a\x07", "application/vnd.rar"),
+    (b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (b"PAR1", "application/vnd.apache.parquet"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+)
+URL_PATTERN = re.compile(  # Plain ascii urls, anything else goes to a full parser
+    r"^(?P<directory>(?P<scheme>[A-Za-z][A-Za-z0-9+.-]*)://"
+    r"(?:[^\s/?#@]*@)?"
+    r"(?P<host>[A-Za-z0-9](?:[A-Za-z0-9.-]*[A-Za-z0-9])?)"
+    r"(?::(?P<port>[0-9]{1,5}))?"
+    r'(?:/[!"$-.0->@-~]*)*?)'  # Path segments but the last
+    r'(?:/[!"$-.0->@-~]*)?'
+    r"(?:[?#][!-~]*)?$"
+)
+URL_DIRECTORY_PATTERN = re.compile(r"(?<=[^/])/[^/?#]*(?:[?#].*)?$")  # Last segment on
+URL_PERCENT_PATTERN = re.compile(r"%([0-9A-Fa-f]{2})")
+URL_UNRESERVED = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~"
+)
+URL_SAFE = "!$&'()*+,;=:@/?%~"  # Left as they are when percent encoding
+URL_PORTS_DEFAULT = {"http": 80, "https": 443, "ftp": 21}
+SINK_ROWS = 1000  # Flush output after this many rows
+SINK_SECONDS = 10.0  # or after this long
+SINK_PARQUET_ROWS = 100000  # Rows per parquet part file, journalled once it's closed
+SINK_PARQUET_WRITERS = 64  # Partitions open at once before part files are rolled
+PARQUET_TYPES = {  # Columns not stored as strings
+    "_content": "binary",
+    "_status": "int32",
+    "Availability": "double",
+    "resources": "int32",
+    "checked": "int32",
+    "available": "int32",
+    "_time_dns": "double",
+    "_time_connect": "double",
+    "_time_tls": "double",
+    "_time_ttfb": "double",
+    "_time_total": "double",
+    "_bytes": "int32",
+}
+RESULT_INTERNED = (  # Result columns of few distinct values, held once each
+    "_encoding",
+    "_mime_type",
+    "_mime_type_sniffed",
+    "_method",
+)
+RESULT_NONE_INT = -(2**63)  # None in a result's integer columns
+TIMING = threading.local()  # Phase timings of the request the thread is making
+TIMING_PHASES = ("dns", "connect", "tls", "ttfb", "total")
 
 
 class Response:
@@ -46,6 +171,14 @@ class Response:
         "_last_modified",
         "_mime_type",
         "_url_redirect",
+        "_mime_type_sniffed",
+        "_method",
+        "_time_dns",
+        "_time_connect",
+        "_time_tls",
+        "_time_ttfb",
+        "_time_total",
+        "_bytes",
     )
 
     def __init__(
@@ -59,6 +192,14 @@ class Response:
         last_modified: Optional[str] = None,
         mime_type: Optional[str] = None,
         url_redirect: Optional[str] = None,
+        mime_type_sniffed: Optional[str] = None,
+        method: Optional[str] = None,
+        time_dns: Optional[float] = None,  # Seconds, None where the phase didn't happen
+        time_connect: Optional[float] = None,
+        time_tls: Optional[float] = None,
+        time_ttfb: Optional[float] = None,
+        time_total: Optional[float] = None,
+        bytes_: Optional[int] = None,
     ):
         self._content = content
         self._status = int(status) if status else None
@@ -68,6 +209,14 @@ class Response:
         self._last_modified = last_modified
         self._mime_type = mime_type
         self._url_redirect = url_redirect
+        self._mime_type_sniffed = mime_type_sniffed
+        self._method = method
+        self._time_dns = time_dns
+        self._time_connect = time_connect
+        self._time_tls = time_tls
+        self._time_ttfb = time_ttfb
+        self._time_total = time_total
+        self._bytes = bytes_
 
     def __repr__(self):
 
@@ -81,7 +230,8 @@ class Response:
 
         return (  # TODO full repr
             f"<{name} {self.status} {status_name} url={self.url!r} length={length} "
-            f"encoding={self.encoding!r} mimetype={self.mime_type!r}>"
+            f"encoding={self.encoding!r} mimetype={self.mime_type!r} "
+            f"sniffed={self.mime_type_sniffed!r}>"
         )
 
     @property
@@ -116,6 +266,138 @@ class Response:
     def url_redirect(self) -> Optional[str]:
         return self._url_redirect
 
+    @property
+    def mime_type_sniffed(self) -> Optional[str]:
+        return self._mime_type_sniffed
+
+    @property
+    def method(self) -> Optional[str]:
+        return self._method
+
+    @property
+    def time_dns(self) -> Optional[float]:
+        return self._time_dns
+
+    @property
+    def time_connect(self) -> Optional[float]:
+        return self._time_connect
+
+    @property
+    def time_tls(self) -> Optional[float]:
+        return self._time_tls
+
+    @property
+    def time_ttfb(self) -> Optional[float]:
+        return self._time_ttfb
+
+    @property
+    def time_total(self) -> Optional[float]:
+        return self._time_total
+
+    @property
+    def bytes_(self) -> Optional[int]:
+        return self._bytes
+
+
+class ResultRow(NamedTuple):
+    """
+    Response's fields as a tuple, its properties without an object per result.
+    Fields are in Response.__slots__ order, bytes_ for _bytes.
+    Also read by column as the dicts results used to be,
+    row["_status"], row.get("_status") and row.keys()
+    """
+
+    content: Optional[bytes]
+    status: Optional[int]
+    url: Optional[str]
+    encoding: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    mime_type: Optional[str]
+    url_redirect: Optional[str]
+    mime_type_sniffed: Optional[str]
+    method: Optional[str]
+    time_dns: Optional[float]
+    time_connect: Optional[float]
+    time_tls: Optional[float]
+    time_ttfb: Optional[float]
+    time_total: Optional[float]
+    bytes_: Optional[int]
+
+    # tuple's own signatures, plus a column name
+    @overload
+    def __getitem__(self, key: SupportsIndex) -> Any:
+        ...
+
+    @overload
+    def __getitem__(self, key: slice) -> tuple[Any, ...]:
+        ...
+
+    @overload
+    def __getitem__(self, key: str) -> Any:
+        ...
+
+    def __getitem__(self, key: Union[SupportsIndex, slice, str]) -> Any:
+
+        if isinstance(key, str):
+            return getattr(self, key[1:] if key != "_bytes" else "bytes_")
+
+        return tuple.__getitem__(self, key)  # type: ignore[index]  # mypy reads it as row[self]
+
+    @classmethod
+    def from_previous(cls, row: dict) -> "ResultRow":
+        """
+        A previous run's row as read back, csv strings for everything,
+        with its numbers typed again and blanks as None.
+        Its body isn't carried, a revalidation doesn't send one
+
+        :param row: Row by column, as in Response.__slots__
+        :type row: dict
+        :return: Row
+        :rtype: ResultRow
+        """
+
+        values = []
+
+        for _ in Response.__slots__:
+
+            value = row.get(_)
+
+            if value is None or value == "" or _ == "_content":
+                value = None
+            elif PARQUET_TYPES.get(_) == "int32":
+                value = int(value)
+            elif PARQUET_TYPES.get(_) == "double":
+                value = float(value)
+
+            values.append(value)
+
+        return cls(*values)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Column of the row, as dict.get
+
+        :param key: Column, as in Response.__slots__
+        :type key: str
+        :param default: Returned for other keys, defaults to None
+        :type default: Any, optional
+        :return: Value
+        :rtype: Any
+        """
+
+        return self.__getitem__(key) if key in Response.__slots__ else default
+
+    def keys(self) -> tuple[str, ...]:
+        """
+        Columns of the row, Response.__slots__
+
+        :return: Columns
+        :rtype: tuple[str, ...]
+        """
+
+        return Response.__slots__
+
 
 class ResponseBuilder:
 
@@ -127,6 +409,8 @@ class ResponseBuilder:
         "_use_proxy",
         "_url_redirect",
         "_method",
+        "_timing",
+        "_sniff",
     )
 
     def __init__(self, *, use_proxy: bool = False):
@@ -137,6 +421,8 @@ class ResponseBuilder:
         self._use_proxy: Optional[bool] = use_proxy
         self._url_redirect: Optional[str] = None
         self._method: str = ""
+        self._timing: Optional[dict] = None
+        self._sniff: bool = False
 
     def content(self, value: Optional[bytes]):
         self._content = value
@@ -156,6 +442,12 @@ class ResponseBuilder:
     def method(self, value: str):
         self._method = value
 
+    def timing(self, value: Optional[dict]):
+        self._timing = value
+
+    def sniff(self, value: bool):
+        self._sniff = value
+
     def build(self) -> Response:
         """
         build _summary_
@@ -164,6 +456,17 @@ class ResponseBuilder:
         :rtype: Response
         """
 
+        return Response(**self.row()._asdict())
+
+    def row(self) -> ResultRow:
+        """
+        The result as a row, a tuple in Response.__slots__ order
+        with Response's properties, no Response or dict made for it
+
+        :return: Row
+        :rtype: ResultRow
+        """
+
         mime_type = encoding = etag = last_modified = None
 
         if self._headers:
@@ -186,311 +489,2665 @@ class ResponseBuilder:
 
         content = None
 
-        if self.method and self.method not in ["HEAD"]:
+        if self._method and self._method not in ["HEAD"]:
             content = self._content
 
-        # TODO analyze content further,
-        # detect_feed_type self._content, mime_type ,
-        # detect_content_encoding self._content, http_encoding
-
-        status = self._status  # if self._status is not None else HTTPStatus.OK.value
-
-        return Response(
-            content=content,
-            status=status,
-            url=self._url,
-            encoding=encoding,
-            etag=etag,
-            last_modified=last_modified,
-            mime_type=mime_type,
-            url_redirect=self._url_redirect,
+        # TODO detect_content_encoding self._content, http_encoding
+        mime_type_sniffed = (
+            sniff_mime_type(content[:SNIFF_BYTES]) if content and self._sniff else None
+        )
+
+        status = (
+            int(self._status) if self._status else None
+        )  # if self._status is not None else HTTPStatus.OK.value
+
+        timing = self._timing or {}
+
+        return ResultRow(
+            content,
+            status,
+            self._url,
+            encoding,
+            etag,
+            last_modified,
+            mime_type,
+            self._url_redirect,
+            mime_type_sniffed,
+            self._method or None,
+            timing.get("dns"),
+            timing.get("connect"),
+            timing.get("tls"),
+            timing.get("ttfb"),
+            timing.get("total"),
+            timing.get("bytes"),
         )
 
 
-def csv_append(
-    filename: Union[str, Path],
-    row_dct: Union[dict, list[dict]],
-    fieldnames: list = None,
-) -> Union[dict, list[dict]]:
+class ResultBuffer:
     """
-     Append to a csv file
-
-    :param filename: _description_
-    :type filename: Union[str, Path]
-    :param row_dct: _description_
-    :type row_dct: Union[dict, list[dict]]
-    :param fieldnames: _description_, defaults to None
-    :type fieldnames: list, optional
-    :return: _description_
-    :rtype: Union[dict, list[dict]]
+    Check results held column-wise instead of a dict per url,
+    numbers in preallocated typed arrays and the few-valued strings interned.
+    Sinks buffer results into one, reuse it across flushes and write it in bulk
     """
 
-    if fieldnames is None:
-        fieldnames = list(
-            row_dct.keys() if isinstance(row_dct, dict) else row_dct[0].keys()
-        )
+    __slots__ = (
+        "_fieldnames",
+        "_kinds",
+        "_columns",
+        "_positions",
+        "_capacity",
+        "_length",
+    )
 
-    with open(filename, "a") as fp:
-        writer = csv.DictWriter(fp, fieldnames=fieldnames)
-        if isinstance(row_dct, dict):
-            writer.writerow(row_dct)
-        else:
-            writer.writerows(row_dct)
+    def __init__(
+        self, fieldnames: Iterable[str] = Response.__slots__, capacity: int = SINK_ROWS
+    ):
+        """
+        :param fieldnames: Columns, defaults to Response.__slots__
+        :type fieldnames: Iterable[str], optional
+        :param capacity: Rows preallocated, grows past it, defaults to SINK_ROWS
+        :type capacity: int, optional
+        """
 
-    return row_dct
+        self._fieldnames = list(fieldnames)
+        self._kinds: list[str] = []
+        self._columns: list[Any] = []
+        # Column positions by kind, appends loop over each kind without branching
+        self._positions: dict[str, list[int]] = {
+            "int32": [],
+            "double": [],
+            "intern": [],
+            "object": [],
+        }
+        self._capacity = max(1, capacity)
+        self._length = 0
 
+        for _ in self._fieldnames:
 
-def retry_logger(
-    url: str, err: Optional[Exception], status: Optional[int], retries: int
-) -> tuple[bool, int]:
-    """
-    Retry logging and try increment
+            kind = PARQUET_TYPES.get(_, "string")
 
-    :param url: URL
-    :type url: str
-    :param err: Error
-    :type err: Exception
-    :param status: response.status_code
-    :type status: int
-    :param retries: Incrementer_
-    :type retries: int
-    :return: _description_
-    :rtype: tuple[bool,int]
-    """
+            if kind == "int32":
+                self._columns.append(array("q", [RESULT_NONE_INT]) * self._capacity)
+            elif kind == "double":
+                self._columns.append(array("d", [math.nan]) * self._capacity)
+            else:
+                kind = "intern" if _ in RESULT_INTERNED else "object"
+                self._columns.append([None] * self._capacity)
 
-    retries += 1
+            self._kinds.append(kind)
+            self._positions[kind].append(len(self._kinds) - 1)
 
-    if retries == REQUEST_RETRIES_MAX:
-        logging.warning(f"Issue with: {url} | Err {err} | Status {str(status)}")
-        return (True, retries)
+    def __len__(self) -> int:
+        return self._length
 
-    logging.error(f"Error with: {url} | Err {err} | Status {str(status)}")
+    def __getitem__(self, index: int) -> ResultRow:
+        return ResultRow(*self.row(index))
 
-    return (False, retries)
+    def __repr__(self):
+        return f"<{type(self).__name__} rows={self._length} capacity={self._capacity}>"
 
+    @property
+    def fieldnames(self) -> list[str]:
+        return self._fieldnames
 
-def fetch(
-    session: requests.Session,
-    url: str,
-    verb: str,
-    timeout: int = REQUEST_TIMEOUT,
-    file_output: Union[Path, str] = None,
-) -> dict:
-    """
-    Sync Fetch sa url and write data to file output
+    def append(self, row: Union[tuple, dict]) -> None:
+        """
+        Add a result, a tuple in column order or a dict by column,
+        as a previous run's row carried forward with strings for everything
 
-    :param session: Session
-    :type session: requests.Session
-    :param url: URL
-    :type url: str
-    :param verb: http method
-    :type verb: str
-    :param timeout: timeout, defaults to REQUEST_TIMEOUT
-    :type timeout: int, optional
-    :param file_output: output to a file_, defaults to None
-    :type file_output: Union[Path,str], optional
-    :raises Exception: Raise exceptions for retry
-    :return: Return dict
-    :rtype: _type_
-    """
+        :param row: Result
+        :type row: Union[tuple, dict]
+        """
 
-    retries = 0
+        if isinstance(row, dict):
+            row = tuple(row.get(_) for _ in self._fieldnames)
+        elif len(row) != len(self._fieldnames):
+            raise ValueError(f"Row of {len(row)} for {len(self._fieldnames)} columns")
+
+        if self._length == self._capacity:
+            # Double up, the arrays stay contiguous
+            for column, kind in zip(self._columns, self._kinds):
+                if kind == "int32":
+                    column.extend(array("q", [RESULT_NONE_INT]) * self._capacity)
+                elif kind == "double":
+                    column.extend(array("d", [math.nan]) * self._capacity)
+                else:
+                    column.extend([None] * self._capacity)
+            self._capacity *= 2
 
-    while retries < REQUEST_RETRIES_MAX + 1:
+        index = self._length
+        columns = self._columns
 
-        try:
-            response = session.request(
-                method=verb, url=url, allow_redirects=True, timeout=timeout
+        for _ in self._positions["object"]:
+            columns[_][index] = row[_]
+
+        for _ in self._positions["intern"]:
+            value = row[_]
+            columns[_][index] = sys.intern(value) if type(value) is str else value
+
+        for _ in self._positions["int32"]:
+            value = row[_]
+            columns[_][index] = (
+                RESULT_NONE_INT if value is None or value == "" else int(value)
             )
 
-            if response.status_code in (408, 502, 503, 504):
+        for _ in self._positions["double"]:
+            value = row[_]
+            columns[_][index] = (
+                math.nan if value is None or value == "" else float(value)
+            )
 
-                ret, retries = retry_logger(
-                    url=url, err=None, status=response.status_code, retries=retries
-                )
-                if ret:
+        self._length += 1
 
-                    builder = ResponseBuilder()
-                    builder.url(url)
-                    builder.status(response.status_code)
+    def row(self, index: int) -> tuple:
+        """
+        A result, None where it has none
 
-                    built = builder.build()
+        :param index: Row
+        :type index: int
+        :return: Values in column order
+        :rtype: tuple
+        """
 
-                    out_dct = {
-                        attr: getattr(built, attr, None) for attr in built.__slots__
-                    }
+        if not 0 <= index < self._length:
+            raise IndexError(f"Row {index} of {self._length}")
 
-                    if file_output:
-                        csv_append(file_output, out_dct)
+        return tuple(
+            None
+            if (kind == "int32" and value == RESULT_NONE_INT)
+            or (kind == "double" and value != value)  # nan
+            else value
+            for column, kind in zip(self._columns, self._kinds)
+            for value in [column[index]]
+        )
 
-                    return out_dct
+    def rows(self) -> Iterator[tuple]:
+        """
+        Results in order, None where they have none
 
-            elif response.status_code:
+        :yield: Values in column order
+        :rtype: Iterator[tuple]
+        """
 
-                builder = ResponseBuilder()
-                builder.url(url)
-                builder.status(response.status_code)
+        yield from zip(*(self.column(_) for _ in range(len(self._fieldnames))))
 
-                if verb not in ["HEAD"]:
-                    builder.content(response.content)
+    def column(self, name: Union[str, int]) -> list:
+        """
+        A column's values, None where they have none
 
-                builder.headers(response.headers)
+        :param name: Column name or position
+        :type name: Union[str, int]
+        :return: Values
+        :rtype: list
+        """
 
-                if response.history:
-                    builder.url(response.history[0].url)
-                    builder.url_redirect(response.url)
-                else:
-                    builder.url(url)
+        idx = name if isinstance(name, int) else self._fieldnames.index(name)
+        kind = self._kinds[idx]
+        values = self._columns[idx][: self._length]
 
-                built = builder.build()
+        if kind == "int32":
+            return [None if _ == RESULT_NONE_INT else _ for _ in values]
+        if kind == "double":
+            return [None if _ != _ else _ for _ in values]  # nan
 
-                out_dct = {attr: getattr(built, attr, None) for attr in built.__slots__}
+        return values
 
-                if file_output:
-                    csv_append(file_output, out_dct)
+    def clear(self) -> None:
+        """
+        Empty it, keeping the arrays, and let go of the objects it held
+        """
 
-                return out_dct
+        for column, kind in zip(self._columns, self._kinds):
+            if kind not in ["int32", "double"]:
+                column[: self._length] = [None] * self._length
 
-            else:
-                raise Exception
-        except (
-            requests.exceptions.ConnectionError,
-            requests.exceptions.Timeout,
-            requests.exceptions.RequestException,
-        ) as err:
-            ret, retries = retry_logger(url=url, err=err, status=None, retries=retries)
-        if ret:
+        self._length = 0
 
-            builder = ResponseBuilder()
-            builder.url(url)
 
-            built = builder.build()
+def timing_start() -> dict:
+    """
+    Start timing a request made from this thread,
+    the timed connections add their phases to it
 
-            out_dct = {attr: getattr(built, attr, None) for attr in built.__slots__}
+    :return: Timing, phases None until they happen
+    :rtype: dict
+    """
 
-            if file_output:
-                csv_append(file_output, out_dct)
+    TIMING.current = dict.fromkeys(TIMING_PHASES)
+    TIMING.current["bytes"] = None
+    TIMING.current["start"] = perf_counter()
 
-            return out_dct
+    return TIMING.current
 
-        sleep(1 * retries)
 
-    builder = ResponseBuilder()
-    builder.url(url)
+def timing_add(phase: str, seconds: float) -> None:
+    """
+    Add to a phase of this thread's timing, a request can connect more than once, redirects say
 
-    built = builder.build()
+    :param phase: dns, connect, tls
+    :type phase: str
+    :param seconds: Elapsed
+    :type seconds: float
+    """
 
-    out_dct = {attr: getattr(built, attr, None) for attr in built.__slots__}
+    timing = getattr(TIMING, "current", None)
 
-    return out_dct
+    if timing is not None:
+        timing[phase] = (timing[phase] or 0.0) + seconds
 
 
-def json_process(dct: dict) -> list[dict]:
+def timing_stop(timing: dict, bytes_: Optional[int] = None) -> dict:
     """
-    Process fields of interest into a dict from ckan response
-    #TODO possibly model this as a class
-    :param dct: _description_
-    :type dct: dict
-    :return: _description_
-    :rtype: list[dict]
+    Finish a timing, rounding phases to the tenth of a millisecond
+
+    :param timing: From timing_start
+    :type timing: dict
+    :param bytes_: Body bytes read, defaults to None
+    :type bytes_: Optional[int], optional
+    :return: Timing
+    :rtype: dict
     """
 
-    def dct_package(dct: dict) -> dict:
+    if timing.get("total") is None:
+        timing["total"] = perf_counter() - timing["start"]
+        timing["bytes"] = bytes_
 
-        measure_dct = {
-            _: None
-            for _ in [
-                "Update",
-                "Format",
-                "Metadata",
-                "License",
-                "Data dictionary",
-                "Availability",
-                "Historic",
-                "API",
-            ]
-        }
+        for _ in TIMING_PHASES:
+            if timing[_] is not None:
+                timing[_] = round(timing[_], 4)
 
-        for _ in [
-            "license_title",
-            "maintainer",
-            "maintainer_email",
-            "license_id",
-            "author",
-            "author_email",
-        ]:
-            measure_dct[_] = dct.get(_)
+    return timing
 
-        for _ in ["id"]:
-            measure_dct[f"_package_{_}"] = dct.get(_)
 
-        for _ in data.get("extras", []):
-            if dct.get("key", None) == "Frequência de atualização":
-                measure_dct["Update"] = dct.get("value")
+class TimedHTTPConnection(HTTPConnection):
+    """
+    urllib3 connection adding name lookup, connect and time to first byte
+    to the calling thread's timing, see timing_start
+    """
 
-        return measure_dct
+    def _new_conn(self) -> socket.socket:
 
-    measure_lst: list[dict] = []
+        if getattr(TIMING, "current", None) is None:
+            return super()._new_conn()
 
-    datas: list = [dct.get("result")]
+        host = self._dns_host
+        start = perf_counter()
 
-    for data in datas:
+        try:
+            addresses = socket.getaddrinfo(
+                host, self.port, allowed_gai_family(), socket.SOCK_STREAM
+            )
+        except OSError:
+            return super()._new_conn()  # So urllib3 reports it as it would
 
-        dct_pack = dct_package(data)
+        timing_add("dns", perf_counter() - start)
 
-        for _ in data.get("resources", []):
+        start = perf_counter()
+        error: Optional[Exception] = None
 
-            dct_resource = deepcopy(dct_pack)
+        try:
+            # Addresses tried in turn, as urllib3 would, just without looking them up again
+            for address in dict.fromkeys(str(_[4][0]) for _ in addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError) as err:
+                    error = err
+            raise error  # type: ignore
+        finally:
+            self._dns_host = host
+            timing_add("connect", perf_counter() - start)
 
-            for fieldname in [
-                "id",
-                "last_modified",
-                "format",
-                "created",
-                "url",
-                "state",
-                "mimetype",
-                "url_type",
-                "resource_type",
-                "name",
-            ]:
+    def getresponse(self, *args, **kwargs) -> Any:  # Response class varies by urllib3
 
-                dct_resource[fieldname] = _.get(fieldname)
+        response = super().getresponse(*args, **kwargs)
 
-            measure_lst.append(dct_resource)
+        timing = getattr(TIMING, "current", None)
 
-    return measure_lst
+        # First response of the request, later ones are redirects
+        if timing is not None and timing["ttfb"] is None:
+            timing["ttfb"] = perf_counter() - timing["start"]
 
+        return response
 
-def ckan_api(session: requests.Session = None) -> requests.Session:
-    """
-    Call the ckan API
 
-    :param session: With a requests session, defaults to None
-    :type session: requests.session, optional
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    """
+    As TimedHTTPConnection, with the TLS handshake timed too
     """
 
-    timeout = 3600
+    def connect(self) -> None:
 
-    if session is None:
+        timing = getattr(TIMING, "current", None)
 
-        session = requests.Session()
-        session.headers.update({"User-Agent": USER_AGENT})
+        if timing is None:
+            return super().connect()
 
-    os.makedirs(DIRECTORY_DATA, exist_ok=True)
+        before = (timing["dns"] or 0.0) + (timing["connect"] or 0.0)
+        start = perf_counter()
 
-    data_dct = fetch(
-        session=session,
-        url=f"{URL_BASE}/action/package_list",
-        verb="GET",
-        timeout=timeout,
-    )
+        try:
+            super().connect()
+        finally:
+            # What connect took beyond the lookup and tcp connect is the handshake,
+            # a failed one included
+            elapsed = perf_counter() - start
+            timing_add(
+                "tls",
+                elapsed
+                - ((timing["dns"] or 0.0) + (timing["connect"] or 0.0) - before),
+            )
 
-    # Write some target fields out, specced in json_process
 
-    file_output = Path(f"{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}.csv")
-    fieldnames = [
-        "Update",
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with timed connections
+    """
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+
+        super().init_poolmanager(*args, **kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+def sniff_mime_type(content: bytes) -> Optional[str]:
+    """
+    Detect a format from the leading bytes of a body, magic bytes
+    for binary formats, else a look at the text (json, html, xml, csv)
+
+    :param content: Leading bytes of a body, possibly cut off
+    :type content: bytes
+    :return: mime type, None if nothing to go on
+    :rtype: Optional[str]
+    """
+
+    if not content:
+        return None
+
+    for magic, mime_type in MAGIC_BYTES:
+
+        if not content.startswith(magic):
+            continue
+
+        if mime_type == "application/zip":
+            # Office formats are zips, OpenDocument stores its type first and uncompressed
+            if content[30:38] == b"mimetype":
+                size = int.from_bytes(content[18:22], "little")
+                return content[38 : 38 + size].decode("ascii", "replace") or mime_type
+            if b"[Content_Types].xml" in content:
+                for folder, office_type in (
+                    (b"xl/", "spreadsheetml.sheet"),
+                    (b"word/", "wordprocessingml.document"),
+                    (b"ppt/", "presentationml.presentation"),
+                ):
+                    if folder in content:
+                        return f"application/vnd.openxmlformats-officedocument.{office_type}"
+
+        return mime_type
+
+    for bom, encoding in (
+        (codecs.BOM_UTF8, "utf-8"),
+        (codecs.BOM_UTF16_LE, "utf-16-le"),
+        (codecs.BOM_UTF16_BE, "utf-16-be"),
+    ):
+        if content.startswith(bom):
+            content = content[len(bom) :]
+            break
+    else:
+        if b"\x00" in content:
+            return "application/octet-stream"
+        encoding = "utf-8"
+
+    text = content.decode(encoding, "replace").lstrip()
+
+    if not text:
+        return None
+
+    if text[0] in "{[":
+        # Cut off, so it can't be parsed, look at what opens it
+        opener = text[1:].lstrip()[:1]
+        if (text[0] == "{" and opener in '"}') or (
+            text[0] == "[" and opener and opener in '{["]-0123456789tfn'
+        ):
+            return "application/json"
+
+    if text[0] == "<":
+        head = text[:1024].lower()
+        if "<html" in head or "<!doctype html" in head or "<body" in head:
+            return "text/html"
+        if "<rss" in head:
+            return "application/rss+xml"
+        if "<feed" in head:
+            return "application/atom+xml"
+        return "application/xml"
+
+    lines = text.splitlines()
+
+    if len(lines) > 1:
+        lines = lines[:-1]  # Likely cut off
+
+    try:
+        dialect = csv.Sniffer().sniff("\n".join(lines), delimiters=",;\t|")
+        if dialect.delimiter in lines[0]:
+            return "text/csv"
+    except csv.Error:
+        pass
+
+    return "text/plain"
+
+
+class RetryDeferred(Exception):
+    """
+    A retry left to the caller, to wait out the host's hold without a worker
+    """
+
+    def __init__(self, retries: int):
+        """
+        :param retries: Retries so far, for the next attempt to carry on from
+        :type retries: int
+        """
+
+        super().__init__(retries)
+        self.retries = retries
+
+
+class HostLimiter:
+    """
+    Per host token bucket and backoff, consulted by fetch before each request.
+    acquire blocks the calling thread, and with it whatever slot the thread holds.
+    fetch_async awaits wait outside its shared slots instead,
+    so a host that is held up only delays its own queue
+    """
+
+    __slots__ = ("_rate", "_burst", "_hosts", "_lock")
+
+    def __init__(
+        self,
+        rate: Optional[float] = REQUEST_RATE_HOST,
+        burst: int = REQUEST_CONCURRENCY_HOST,
+    ):
+        """
+        :param rate: Requests per second per host, None for backoff only, defaults to REQUEST_RATE_HOST
+        :type rate: Optional[float], optional
+        :param burst: Bucket size, defaults to REQUEST_CONCURRENCY_HOST
+        :type burst: int, optional
+        """
+
+        self._rate = rate
+        self._burst = burst
+        # host: [tokens, refilled at, held until]
+        self._hosts: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} rate={self._rate} burst={self._burst} hosts={len(self._hosts)}>"
+
+    def _host(self, host: str) -> list[float]:
+
+        if host not in self._hosts:
+            self._hosts[host] = [float(self._burst), monotonic(), 0.0]
+
+        return self._hosts[host]
+
+    def wait(self, host: str) -> float:
+        """
+        Take a token if the host has one and isn't backing off, without blocking
+
+        :param host: Hostname
+        :type host: str
+        :return: 0.0 with a token taken, else seconds before asking again
+        :rtype: float
+        """
+
+        with self._lock:
+
+            bucket = self._host(host)
+            now = monotonic()
+
+            if self._rate:
+                bucket[0] = min(
+                    float(self._burst), bucket[0] + (now - bucket[1]) * self._rate
+                )
+                bucket[1] = now
+
+            if now < bucket[2]:
+                return bucket[2] - now
+            elif not self._rate or bucket[0] >= 1:
+                if self._rate:
+                    bucket[0] -= 1
+                return 0.0
+            else:
+                return (1 - bucket[0]) / self._rate
+
+    def acquire(self, host: str) -> float:
+        """
+        Block until the host has a token and isn't backing off
+
+        :param host: Hostname
+        :type host: str
+        :return: Seconds waited
+        :rtype: float
+        """
+
+        waited = 0.0
+
+        while True:
+
+            wait = self.wait(host)
+            if not wait:
+                return waited
+
+            sleep(wait)
+            waited += wait
+
+    def backoff(
+        self, host: str, retries: int, retry_after: Optional[str] = None
+    ) -> float:
+        """
+        Hold the host back, honouring Retry-After if given,
+        else exponential backoff with full jitter
+
+        :param host: Hostname
+        :type host: str
+        :param retries: Retries so far
+        :type retries: int
+        :param retry_after: Retry-After header, seconds or http date, defaults to None
+        :type retry_after: Optional[str], optional
+        :return: Seconds the host is held for
+        :rtype: float
+        """
+
+        delay = retry_after_parse(retry_after)
+
+        if delay is None:
+            delay = random.uniform(
+                0, min(REQUEST_BACKOFF_MAX, REQUEST_BACKOFF * 2 ** max(retries - 1, 0))
+            )
+
+        with self._lock:
+            bucket = self._host(host)
+            bucket[2] = max(bucket[2], monotonic() + delay)
+
+        return delay
+
+
+class HostBreaker:
+    """
+    Per host circuit breaker for checking. After consecutive connection / dns
+    failures a host opens and its urls fail straight away,
+    bar a single half open probe once the cooldown is up
+    """
+
+    __slots__ = ("_failures", "_cooldown", "_hosts", "_lock")
+
+    def __init__(
+        self,
+        failures: int = REQUEST_BREAKER_FAILURES,
+        cooldown: float = REQUEST_BREAKER_COOLDOWN,
+    ):
+        """
+        :param failures: Consecutive failures to open, defaults to REQUEST_BREAKER_FAILURES
+        :type failures: int, optional
+        :param cooldown: Seconds open before a probe, defaults to REQUEST_BREAKER_COOLDOWN
+        :type cooldown: float, optional
+        """
+
+        self._failures = failures
+        self._cooldown = cooldown
+        # host: [consecutive failures, opened at or 0 if closed, probe in flight]
+        self._hosts: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} failures={self._failures} cooldown={self._cooldown} open={sum(1 for _ in self._hosts.values() if _[1])}>"
+
+    def allow(self, host: str) -> bool:
+        """
+        Whether to try the host, True for closed or a half open probe
+
+        :param host: Hostname
+        :type host: str
+        :return: Try it
+        :rtype: bool
+        """
+
+        with self._lock:
+
+            state = self._hosts.get(host)
+
+            if state is None or not state[1]:
+                return True
+
+            if not state[2] and monotonic() - state[1] >= self._cooldown:
+                state[2] = True  # Half open, one probe at a time
+                return True
+
+            return False
+
+    def is_open(self, host: str) -> bool:
+        """
+        Whether the host's urls are being skipped, as allow
+        but without claiming the half open probe
+
+        :param host: Hostname
+        :type host: str
+        :return: Skip it
+        :rtype: bool
+        """
+
+        with self._lock:
+
+            state = self._hosts.get(host)
+
+            if state is None or not state[1]:
+                return False
+
+            return state[2] or monotonic() - state[1] < self._cooldown
+
+    def release(self, host: str) -> None:
+        """
+        Nothing was learnt of the host, the url never went out,
+        give up a half open probe so another url makes it
+
+        :param host: Hostname
+        :type host: str
+        """
+
+        with self._lock:
+
+            state = self._hosts.get(host)
+
+            if state is not None:
+                state[2] = False
+
+    def success(self, host: str) -> None:
+        """
+        The host answered, close it
+
+        :param host: Hostname
+        :type host: str
+        """
+
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failure(self, host: str) -> bool:
+        """
+        The host couldn't be reached
+
+        :param host: Hostname
+        :type host: str
+        :return: Whether the host is now open
+        :rtype: bool
+        """
+
+        with self._lock:
+
+            state = self._hosts.setdefault(host, [0, 0.0, False])
+            state[0] += 1
+
+            if state[1] or state[0] >= self._failures:
+                if not state[1]:
+                    logging.error(f"Host unreachable, skipping: {host}")
+                state[1] = monotonic()  # Failed probes restart the cooldown
+                state[2] = False
+
+            return bool(state[1])
+
+
+def retry_after_parse(retry_after: Optional[str]) -> Optional[float]:
+    """
+    Seconds to wait from a Retry-After header
+
+    :param retry_after: Header, delta seconds or an http date
+    :type retry_after: Optional[str]
+    :return: Seconds, capped at REQUEST_RETRY_AFTER_MAX, None if absent or unparseable
+    :rtype: Optional[float]
+    """
+
+    if not retry_after:
+        return None
+
+    retry_after = retry_after.strip()
+
+    if retry_after.isdigit():
+        delay = float(retry_after)
+    else:
+        try:
+            delay = parsedate_to_datetime(retry_after).timestamp() - time()
+        except (TypeError, ValueError):
+            return None
+
+    return min(max(delay, 0.0), REQUEST_RETRY_AFTER_MAX)
+
+
+class FtpPool:
+    """
+    Logged in ftp control connections reused per host and login,
+    with directory listings cached by host and path.
+    MLSD is preferred, falling back to LIST parsed with ftpparser
+    """
+
+    __slots__ = ("_timeout", "_connections", "_listings", "_mlsd")
+
+    def __init__(self, timeout: int = REQUEST_TIMEOUT):
+        """
+        :param timeout: Connection timeout, defaults to REQUEST_TIMEOUT
+        :type timeout: int, optional
+        """
+
+        self._timeout = timeout
+        self._connections: dict[tuple, ftplib.FTP] = {}
+        self._listings: dict[tuple, dict[str, dict]] = {}
+        self._mlsd: dict[tuple, bool] = {}  # Whether the server speaks MLSD
+
+    def __enter__(self) -> "FtpPool":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} connections={len(self._connections)} listings={len(self._listings)}>"
+
+    def connection(
+        self,
+        host: str,
+        port: Optional[int] = None,
+        user: Optional[str] = None,
+        passwd: Optional[str] = None,
+    ) -> ftplib.FTP:
+        """
+        Get a logged in connection, opening one if need be
+
+        :param host: Host
+        :type host: str
+        :param port: Port, defaults to None, 21
+        :type port: Optional[int], optional
+        :param user: User, defaults to None, anonymous
+        :type user: Optional[str], optional
+        :param passwd: Password, defaults to None
+        :type passwd: Optional[str], optional
+        :return: Connection
+        :rtype: ftplib.FTP
+        """
+
+        key = (host, port or ftplib.FTP_PORT, user or "", passwd or "")
+
+        if key not in self._connections:
+            start = perf_counter()
+            # https://bugs.python.org/issue30956
+            ftp = ftplib.FTP(timeout=self._timeout)
+            ftp.connect(host=host, port=key[1])
+            ftp.login(user=key[2], passwd=key[3])
+            self._connections[key] = ftp
+            # Name lookup, connect and login together
+            timing_add("connect", perf_counter() - start)
+
+        return self._connections[key]
+
+    def discard(
+        self,
+        host: str,
+        port: Optional[int] = None,
+        user: Optional[str] = None,
+        passwd: Optional[str] = None,
+    ) -> None:
+        """
+        Drop a connection, after an error say
+        """
+
+        key = (host, port or ftplib.FTP_PORT, user or "", passwd or "")
+
+        ftp = self._connections.pop(key, None)
+
+        if ftp is not None:
+            with suppress(*ftplib.all_errors):
+                ftp.close()
+
+    def listing(
+        self,
+        host: str,
+        path: str,
+        port: Optional[int] = None,
+        user: Optional[str] = None,
+        passwd: Optional[str] = None,
+    ) -> dict[str, dict]:
+        """
+        Files in a directory, cached
+
+        :param host: Host
+        :type host: str
+        :param path: Absolute directory path
+        :type path: str
+        :param port: Port, defaults to None, 21
+        :type port: Optional[int], optional
+        :param user: User, defaults to None, anonymous
+        :type user: Optional[str], optional
+        :param passwd: Password, defaults to None
+        :type passwd: Optional[str], optional
+        :raises ftplib.all_errors: If the listing fails on a fresh connection
+        :return: name: {name, size, timestamp, url_redirect}
+        :rtype: dict[str, dict]
+        """
+
+        key = (host, port or ftplib.FTP_PORT, user or "", path)
+
+        if key in self._listings:
+            return self._listings[key]
+
+        for attempt in range(2):  # Pooled connections may have been dropped server side
+
+            ftp = self.connection(host, port, user, passwd)
+
+            try:
+                self._listings[key] = self._listing(ftp, key[:3], path)
+                break
+
+            except (ftplib.error_perm, ftplib.error_proto):
+                raise  # Missing directory say, the connection is fine
+
+            except ftplib.all_errors:
+                self.discard(host, port, user, passwd)
+                if attempt:
+                    raise
+
+        return self._listings[key]
+
+    def _listing(self, ftp: ftplib.FTP, server: tuple, path: str) -> dict[str, dict]:
+
+        files_dct: dict[str, dict] = {}
+
+        if self._mlsd.get(server, True):
+            try:
+                for name, facts in ftp.mlsd(path, facts=["type", "size", "modify"]):
+                    if facts.get("type") == "file":
+                        files_dct[name] = {
+                            "name": name,
+                            "size": int(facts["size"]) if "size" in facts else None,
+                            "timestamp": timegm(
+                                (
+                                    int(facts["modify"][0:4]),
+                                    int(facts["modify"][4:6]),
+                                    int(facts["modify"][6:8]),
+                                    int(facts["modify"][8:10]),
+                                    int(facts["modify"][10:12]),
+                                    int(facts["modify"][12:14]),
+                                )
+                            )
+                            if len(facts.get("modify", "")) >= 14
+                            else None,
+                            "url_redirect": None,
+                        }
+
+                self._mlsd[server] = True
+
+                return files_dct
+
+            except ftplib.error_perm as e:
+                if not str(e).startswith(("500", "501", "502")):
+                    raise
+                self._mlsd[server] = False  # Unknown command, LIST from now on
+
+        import ftpparser
+
+        dir_list: list[str] = []
+
+        ftp.cwd(path)
+        ftp.retrlines("LIST", dir_list.append)
+
+        # name, size, timestamp, isdirectory, downloadable, islink, permissions
+        for _ in ftpparser.FTPParser().parse(dir_list):
+            if _[3] == 0 and _[4] == 1:
+                files_dct[_[0]] = {
+                    "name": _[0],
+                    "size": _[1],
+                    "timestamp": _[2],
+                    "url_redirect": _[5],
+                }
+
+        return files_dct
+
+    def close(self) -> None:
+        """
+        Quit all connections
+        """
+
+        for ftp in self._connections.values():
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+
+        self._connections.clear()
+
+
+class Checkpoint:
+    """
+    Append only journal of completed work, package ids or urls one per line,
+    read back to skip them when resuming
+    """
+
+    __slots__ = ("_filename", "_keys", "_pending", "_lock", "_completed")
+
+    COMPLETE = "\0complete"  # Written once the run finished
+
+    def __init__(self, filename: Union[str, Path], resume: bool = False):
+        """
+        :param filename: Journal file
+        :type filename: Union[str, Path]
+        :param resume: Load the existing journal, else start a new one, defaults to False
+        :type resume: bool, optional
+        """
+
+        self._filename = filename
+        self._keys: set[str] = set()
+        self._pending: list[str] = []
+        self._lock = threading.Lock()
+        self._completed = False
+
+        if resume and Path(filename).is_file():
+            with open(filename) as f:
+                for line in f:
+                    key = line.rstrip("\n")
+                    if key == self.COMPLETE:
+                        self._completed = True
+                    elif key:
+                        self._keys.add(key)
+        else:
+            Path(filename).write_text("")  # A fresh journal, any old one emptied
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {str(self._filename)!r} keys={len(self._keys)} completed={self._completed}>"
+
+    @property
+    def completed(self) -> bool:
+        return self._completed
+
+    def add(self, keys: Iterable[Optional[str]]) -> None:
+        """
+        Mark keys done, written on the next flush
+
+        :param keys: package ids or urls, empty ones skipped
+        :type keys: Iterable[Optional[str]]
+        """
+
+        with self._lock:
+            for key in keys:
+                if key and key not in self._keys:
+                    self._keys.add(key)
+                    self._pending.append(key)
+
+    def flush(self) -> None:
+        """
+        Append pending keys to the journal
+        """
+
+        with self._lock:
+            if self._pending:
+                with open(self._filename, "a") as f:
+                    f.writelines(f"{_}\n" for _ in self._pending)
+                self._pending.clear()
+
+    def complete(self) -> None:
+        """
+        Flush and mark the run as finished
+        """
+
+        self.flush()
+
+        with self._lock:
+            with open(self._filename, "a") as f:
+                f.write(f"{self.COMPLETE}\n")
+            self._completed = True
+
+
+class CsvSink:
+    """
+    Long lived csv writer buffering rows, flushed by row count or elapsed time.
+    Safe to share between threads / async tasks, use as a context manager
+    so the buffer is always flushed, on errors too
+    """
+
+    __slots__ = (
+        "_filename",
+        "_fieldnames",
+        "_rows",
+        "_seconds",
+        "_buffer",
+        "_lock",
+        "_closed",
+        "_fp",
+        "_writer",
+        "_thread",
+        "_checkpoint",
+        "_checkpoint_key",
+        "_keys",
+    )
+
+    def __init__(
+        self,
+        filename: Union[str, Path],
+        fieldnames: Optional[Iterable[str]] = None,
+        *,
+        mode: str = "a",
+        header: bool = False,
+        rows: int = SINK_ROWS,
+        seconds: Optional[float] = SINK_SECONDS,
+        checkpoint: Optional[Checkpoint] = None,
+        checkpoint_key: str = "_url",
+    ):
+        """
+        :param filename: File to write to
+        :type filename: Union[str, Path]
+        :param fieldnames: Columns, defaults to the keys of the first row
+        :type fieldnames: Optional[Iterable[str]], optional
+        :param mode: File mode, "w" to truncate, defaults to "a"
+        :type mode: str, optional
+        :param header: Write the header on open, defaults to False
+        :type header: bool, optional
+        :param rows: Flush after this many rows, defaults to SINK_ROWS
+        :type rows: int, optional
+        :param seconds: Flush at least this often, None to only flush by rows, defaults to SINK_SECONDS
+        :type seconds: Optional[float], optional
+        :param checkpoint: Journal written keys once their rows are flushed, defaults to None
+        :type checkpoint: Optional[Checkpoint], optional
+        :param checkpoint_key: Column journalled when no keys are given, defaults to "_url"
+        :type checkpoint_key: str, optional
+        """
+
+        self._filename = filename
+        self._fieldnames: Optional[list[str]] = (
+            list(fieldnames) if fieldnames is not None else None
+        )
+        self._rows = rows
+        self._seconds = seconds
+        # Results are buffered column-wise, anything else as dicts
+        self._buffer: Union[list[dict], ResultBuffer] = (
+            ResultBuffer(self._fieldnames, rows)
+            if self._fieldnames == list(Response.__slots__)
+            else []
+        )
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._writer: Optional[csv.DictWriter] = None
+        self._thread: Optional[threading.Thread] = None
+        self._checkpoint = checkpoint
+        self._checkpoint_key = checkpoint_key
+        self._keys: list[Optional[str]] = []
+
+        self._open(mode, header)
+
+        if seconds:
+            # Flush on a timer too, slow hosts shouldn't hold rows back
+            self._thread = threading.Thread(target=self._flush_timer, daemon=True)
+            self._thread.start()
+
+        atexit.register(self.close)
+
+    def __enter__(self) -> "CsvSink":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {str(self._filename)!r} buffered={len(self._buffer)}>"
+
+    @property
+    def filename(self) -> Union[str, Path]:
+        return self._filename
+
+    @property
+    def fieldnames(self) -> Optional[list[str]]:
+        return self._fieldnames
+
+    @property
+    def checkpoint(self) -> Optional[Checkpoint]:
+        return self._checkpoint
+
+    @property
+    def journal(self) -> Checkpoint:
+        """
+        The checkpoint of a sink opened with one
+
+        :raises ValueError: Opened without a journal
+        :return: Checkpoint
+        :rtype: Checkpoint
+        """
+
+        if self._checkpoint is None:
+            raise ValueError(f"No journal for {self._filename}")
+
+        return self._checkpoint
+
+    def _open(self, mode: str, header: bool) -> None:
+
+        # Held open across writes, close() is what closes it
+        self._fp = open(self._filename, mode)  # noqa: SIM115
+
+        if header:
+            self._writer_get().writeheader()
+            self._fp.flush()
+
+    def _rows_write(self, rows: Union[list[dict], ResultBuffer]) -> None:
+
+        if isinstance(rows, ResultBuffer):
+            # Tuples in column order, straight to the underlying writer
+            self._writer_get().writer.writerows(rows.rows())
+        elif rows:
+            self._writer_get().writerows(rows)
+
+        self._fp.flush()
+
+    def _journal(self, keys: list[Optional[str]]) -> None:
+
+        self.journal.add(keys)
+        self.journal.flush()
+
+    def _file_close(self) -> None:
+        self._fp.close()
+
+    def _writer_get(self) -> csv.DictWriter:
+
+        if self._writer is None:
+            if self._fieldnames is None:
+                raise ValueError(f"No fieldnames for {self._filename}")
+            self._writer = csv.DictWriter(self._fp, fieldnames=self._fieldnames)
+
+        return self._writer
+
+    def _flush_timer(self) -> None:
+
+        while not self._closed.wait(self._seconds):
+            self.flush()
+
+    def write(
+        self,
+        row_dct: Union[
+            ResultRow, dict[str, Any], list[ResultRow], list[dict[str, Any]]
+        ],
+        keys: Optional[Iterable[Optional[str]]] = None,
+    ) -> None:
+        """
+        Buffer a row or rows, flushing if the buffer is full
+
+        :param row_dct: Row or rows, results as ResultRow tuples too
+        :type row_dct: Union[ResultRow, dict[str, Any], list[ResultRow], list[dict[str, Any]]]
+        :param keys: Keys to journal with the rows, defaults to the rows' checkpoint_key
+        :type keys: Optional[Iterable[Optional[str]]], optional
+        """
+
+        with self._lock:
+
+            if self._closed.is_set():
+                raise ValueError(f"Write to closed {self!r}")
+
+            rows: Sequence[Union[ResultRow, dict[str, Any]]] = (
+                [row_dct] if isinstance(row_dct, (dict, tuple)) else row_dct
+            )
+
+            if isinstance(self._buffer, ResultBuffer):
+                for _ in rows:
+                    self._buffer.append(_)
+            else:
+                self._buffer.extend(
+                    _ if isinstance(_, dict) else dict(zip(_.keys(), _)) for _ in rows
+                )
+
+            if self._checkpoint is not None:
+                self._keys.extend(
+                    keys
+                    if keys is not None
+                    else (_.get(self._checkpoint_key) for _ in rows)
+                )
+
+            if self._fieldnames is None and self._buffer:
+                self._fieldnames = list(self._buffer[0].keys())
+
+            if len(self._buffer) >= self._rows:
+                self.flush()
+
+    def flush(self) -> None:
+        """
+        Write out buffered rows
+        """
+
+        with self._lock:
+
+            if self._closed.is_set():
+                return
+
+            self._rows_write(self._buffer)
+
+            # Journal only once rows are out, it can lag the output but never lead it
+            if self._checkpoint is not None:
+                self._journal(self._keys)
+                self._keys.clear()
+
+            self._buffer.clear()
+
+    def close(self) -> None:
+        """
+        Flush and close, safe to call more than once
+        """
+
+        with self._lock:
+
+            if self._closed.is_set():
+                return
+
+            try:
+                self.flush()
+            finally:
+                self._closed.set()
+                self._file_close()
+
+        atexit.unregister(self.close)
+
+
+class ParquetSink(CsvSink):
+    """
+    Columnar counterpart of CsvSink, a parquet dataset directory of part files
+    optionally hive partitioned by url host or run date, host=.../part-....parquet.
+    Each flush is a row group, part files are written as dot files and renamed
+    once closed, only then are their keys journalled
+    """
+
+    __slots__ = (
+        "_partition",
+        "_column_url",
+        "_run",
+        "_date",
+        "_schema",
+        "_writers",
+        "_rows_part",
+        "_keys_part",
+    )
+
+    def __init__(
+        self,
+        filename: Union[str, Path],
+        fieldnames: Iterable[str],
+        *,
+        partition: Optional[str] = None,
+        **kwargs,
+    ):
+        """
+        :param filename: Dataset directory
+        :type filename: Union[str, Path]
+        :param fieldnames: Columns, typed by PARQUET_TYPES else strings
+        :type fieldnames: Iterable[str]
+        :param partition: host, date or None, defaults to None
+        :type partition: Optional[str], optional
+        :param kwargs: As CsvSink
+        """
+
+        try:
+            import pyarrow as pa
+        except ImportError as err:
+            raise ImportError(
+                "Parquet output needs pyarrow, install the parquet extra"
+            ) from err
+
+        if partition not in [None, "host", "date"]:
+            raise ValueError(f"Unknown partition {partition}")
+
+        fieldnames = list(fieldnames)
+
+        self._partition = partition
+        self._column_url = "_url" if "_url" in fieldnames else "url"
+        self._run = int(time() * 1000)  # Part files of this run
+        self._date = strftime("%Y-%m-%d")
+        self._schema = pa.schema(
+            [(_, pa.type_for_alias(PARQUET_TYPES.get(_, "string"))) for _ in fieldnames]
+        )
+        self._writers: dict[str, Any] = {}
+        self._rows_part = 0
+        self._keys_part: list[Optional[str]] = []
+
+        super().__init__(filename, fieldnames, **kwargs)
+
+    def _open(self, mode: str, header: bool) -> None:
+
+        directory = Path(self._filename)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        # Dot files are parts a crashed run never closed, their keys weren't journalled
+        for _ in directory.rglob(".part-*.parquet"):
+            _.unlink()
+
+        if mode == "w":
+            for _ in directory.rglob("part-*.parquet"):
+                _.unlink()
+
+    def _partition_key(self, url: Optional[str]) -> str:
+
+        if self._partition == "host":
+            value = urlsplit(str(url or "")).hostname
+            return f"host={value or '__HIVE_DEFAULT_PARTITION__'}"
+
+        if self._partition == "date":
+            return f"date={self._date}"
+
+        return ""
+
+    def _column(self, name: str, values: Iterable[Any]) -> list:
+
+        kind = PARQUET_TYPES.get(name, "string")
+        column = []
+
+        for value in values:
+
+            # Rows carried forward from a csv have strings for everything
+            if value is None or value == "":
+                value = None
+            elif kind == "int32":
+                value = int(value) if str(value).isdigit() else None
+            elif kind == "double":
+                value = float(value)
+            elif kind == "binary":
+                value = value if isinstance(value, bytes) else str(value).encode()
+            else:
+                value = str(value)
+
+            column.append(value)
+
+        return column
+
+    def _rows_write(self, rows: Union[list[dict], ResultBuffer]) -> None:
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if (
+            self._rows_part >= SINK_PARQUET_ROWS
+            or len(self._writers) > SINK_PARQUET_WRITERS
+        ):
+            self._roll()
+
+        # Row positions by partition
+        groups: dict[str, list[int]] = {}
+
+        if isinstance(rows, ResultBuffer):
+            columns = {_: rows.column(_) for _ in rows.fieldnames}
+        else:
+            columns = {_.name: [row.get(_.name) for row in rows] for _ in self._schema}
+
+        if self._partition is None:
+            if len(rows):
+                groups[""] = list(range(len(rows)))
+        else:
+            for idx, url in enumerate(columns[self._column_url]):
+                groups.setdefault(self._partition_key(url), []).append(idx)
+
+        for key, group in groups.items():
+
+            if key not in self._writers:
+                directory = Path(self._filename, key)
+                directory.mkdir(parents=True, exist_ok=True)
+                self._writers[key] = pq.ParquetWriter(
+                    str(directory / f".part-{self._run}-{len(self._writers)}.parquet"),
+                    self._schema,
+                )
+
+            self._writers[key].write_table(
+                pa.table(
+                    [
+                        pa.array(
+                            self._column(
+                                _.name,
+                                columns[_.name]
+                                if len(group) == len(rows)
+                                else (columns[_.name][idx] for idx in group),
+                            ),
+                            _.type,
+                        )
+                        for _ in self._schema
+                    ],
+                    schema=self._schema,
+                )
+            )
+
+        self._rows_part += len(rows)
+
+    def _roll(self) -> None:
+        """
+        Close the open part files, then journal the keys of the rows in them
+        """
+
+        for writer in self._writers.values():
+            writer.close()
+            path = Path(writer.where)
+            path.rename(path.with_name(path.name[1:]))
+
+        self._writers.clear()
+        self._rows_part = 0
+        self._run += 1  # Part file names stay unique across rolls
+
+        if self._checkpoint is not None:
+            super()._journal(self._keys_part)
+            self._keys_part.clear()
+
+    def _journal(self, keys: list[Optional[str]]) -> None:
+        self._keys_part.extend(keys)
+
+    def _file_close(self) -> None:
+        self._roll()
+
+
+def sink_open(
+    file_output: Union[str, Path],
+    fieldnames: Iterable[str],
+    resume: bool = False,
+    checkpoint_key: str = "_url",
+    output_format: str = "csv",
+    partition: Optional[str] = None,
+    journal: bool = True,
+) -> CsvSink:
+    """
+    Open an output with its checkpoint journal alongside, file_output.journal.
+    Resuming appends to the output, else it is truncated
+
+    :param file_output: Output file
+    :type file_output: Union[str, Path]
+    :param fieldnames: Columns
+    :type fieldnames: Iterable[str]
+    :param resume: Resume from the journal, defaults to False
+    :type resume: bool, optional
+    :param checkpoint_key: Column journalled, defaults to "_url"
+    :type checkpoint_key: str, optional
+    :param output_format: csv or parquet, a dataset directory, defaults to "csv"
+    :type output_format: str, optional
+    :param partition: Parquet partitioned by host or date, defaults to None
+    :type partition: Optional[str], optional
+    :param journal: Keep a checkpoint journal, else the output is always rewritten, defaults to True
+    :type journal: bool, optional
+    :return: Sink, with its checkpoint
+    :rtype: CsvSink
+    """
+
+    file_journal = Path(f"{file_output}.journal")
+
+    if output_format == "parquet":
+        written = any(Path(file_output).rglob("part-*.parquet"))
+    elif output_format == "csv":
+        written = Path(file_output).is_file() and Path(file_output).stat().st_size > 0
+    else:
+        raise ValueError(f"Unknown output format {output_format}")
+
+    # Without a journal there is nothing to resume from, so start afresh
+    append = journal and resume and file_journal.is_file() and written
+
+    checkpoint = Checkpoint(file_journal, resume=append) if journal else None
+
+    if output_format == "parquet":
+        return ParquetSink(
+            file_output,
+            fieldnames,
+            partition=partition,
+            mode="a" if append else "w",
+            checkpoint=checkpoint,
+            checkpoint_key=checkpoint_key,
+        )
+
+    return CsvSink(
+        file_output,
+        fieldnames,
+        mode="a" if append else "w",
+        header=not append,
+        checkpoint=checkpoint,
+        checkpoint_key=checkpoint_key,
+    )
+
+
+def csv_append(
+    filename: Union[str, Path, CsvSink],
+    row_dct: Union[dict, ResultRow, list[dict]],
+    fieldnames: list = None,
+    keys: Optional[Iterable[str]] = None,
+) -> Union[dict, ResultRow, list[dict]]:
+    """
+     Append to a csv file, or buffer to a CsvSink
+
+    :param filename: _description_
+    :type filename: Union[str, Path, CsvSink]
+    :param row_dct: _description_, a result as a ResultRow too
+    :type row_dct: Union[dict, ResultRow, list[dict]]
+    :param fieldnames: _description_, defaults to None
+    :type fieldnames: list, optional
+    :param keys: Keys to journal, for a CsvSink with a checkpoint, defaults to None
+    :type keys: Optional[Iterable[str]], optional
+    :return: _description_
+    :rtype: Union[dict, list[dict]]
+    """
+
+    if isinstance(filename, CsvSink):
+        filename.write(row_dct, keys=keys)
+        return row_dct
+
+    if isinstance(row_dct, ResultRow):
+        row_dct = dict(zip(Response.__slots__, row_dct))
+
+    if fieldnames is None:
+        fieldnames = list(
+            row_dct.keys() if isinstance(row_dct, dict) else row_dct[0].keys()
+        )
+
+    with open(filename, "a") as fp:
+        writer = csv.DictWriter(fp, fieldnames=fieldnames)
+        if isinstance(row_dct, dict):
+            writer.writerow(row_dct)
+        else:
+            writer.writerows(row_dct)
+
+    return row_dct
+
+
+def retry_logger(
+    url: str, err: Optional[Exception], status: Optional[int], retries: int
+) -> tuple[bool, int]:
+    """
+    Retry logging and try increment
+
+    :param url: URL
+    :type url: str
+    :param err: Error
+    :type err: Exception
+    :param status: response.status_code
+    :type status: int
+    :param retries: Incrementer_
+    :type retries: int
+    :return: _description_
+    :rtype: tuple[bool,int]
+    """
+
+    retries += 1
+
+    if retries == REQUEST_RETRIES_MAX:
+        logging.warning(f"Issue with: {url} | Err {err} | Status {str(status)}")
+        return (True, retries)
+
+    logging.error(f"Error with: {url} | Err {err} | Status {str(status)}")
+
+    return (False, retries)
+
+
+def headers_conditional(row_dct: dict) -> dict:
+    """
+    Conditional request headers from a previous result row
+
+    :param row_dct: Row as written from Response.__slots__
+    :type row_dct: dict
+    :return: If-None-Match / If-Modified-Since headers, empty if nothing to send
+    :rtype: dict
+    """
+
+    headers = {}
+
+    if row_dct.get("_etag"):
+        headers["If-None-Match"] = row_dct["_etag"]
+
+    if row_dct.get("_last_modified"):
+        headers["If-Modified-Since"] = row_dct["_last_modified"]
+
+    return headers
+
+
+def rows_read(
+    file_input: Union[Path, str], columns: Optional[list[str]] = None
+) -> Iterator[dict]:
+    """
+    Read rows back from an output, csv or a parquet dataset directory.
+    Parquet reads only the columns asked for
+
+    :param file_input: csv file or parquet directory
+    :type file_input: Union[Path, str]
+    :param columns: Columns wanted, defaults to None, all of them
+    :type columns: Optional[list[str]], optional
+    :yield: Rows
+    :rtype: Iterator[dict]
+    """
+
+    if Path(file_input).is_dir():
+
+        try:
+            import pyarrow.dataset as ds
+        except ImportError as err:
+            raise ImportError(
+                "Parquet input needs pyarrow, install the parquet extra"
+            ) from err
+
+        # Partition keys are left out, they're derived from columns already there
+        dataset = ds.dataset(str(file_input), format="parquet")
+
+        for batch in dataset.to_batches(columns=columns):
+            yield from batch.to_pylist()
+
+    else:
+        with open(file_input) as f:
+            yield from csv.DictReader(f)
+
+
+def rows_previous(file_input: Union[Path, str]) -> dict[str, dict]:
+    """
+    Load a previous run's results for revalidation, keyed by url.
+    Only rows that can be revalidated, a success with an etag or last modified
+
+    :param file_input: Results file, Response.__slots__ columns
+    :type file_input: Union[Path, str]
+    :return: Rows by url
+    :rtype: dict[str, dict]
+    """
+
+    rows: dict[str, dict] = {}
+
+    if Path(file_input).exists() is False:
+        return rows
+
+    for _ in rows_read(file_input):
+
+        status = str(_.get("_status") or "")
+
+        if (
+            status.isdigit()
+            and int(status) < 400
+            and (_.get("_etag") or _.get("_last_modified"))
+        ):
+            rows[_["_url"]] = _
+
+    return rows
+
+
+def content_read(response: requests.Response, max_bytes: Optional[int]) -> bytes:
+    """
+    Read a body, from a streamed response at most max_bytes of it
+
+    :param response: Response
+    :type response: requests.Response
+    :param max_bytes: Bytes to keep, None for the whole body
+    :type max_bytes: Optional[int]
+    :return: Body
+    :rtype: bytes
+    """
+
+    if max_bytes is None:
+        return response.content
+
+    chunks: list[bytes] = []
+    size = 0
+
+    try:
+        for chunk in response.iter_content(chunk_size=min(REQUEST_CHUNK, max_bytes)):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                break
+    finally:
+        response.close()  # Drops the connection if the body was cut off
+
+    return b"".join(chunks)[:max_bytes]
+
+
+def json_items(chunks: Iterable[bytes], path: tuple[str, ...]) -> Iterator[Any]:
+    """
+    Parse the items of the json array at path incrementally,
+    only an item and a chunk are held in memory at once
+
+    :param chunks: utf-8 json, in chunks
+    :type chunks: Iterable[bytes]
+    :param path: Object keys to the array, ("result", "results") say
+    :type path: tuple[str, ...]
+    :raises ValueError: For json that isn't objects down to an array
+    :yield: Items of the array, nothing if path isn't there
+    :rtype: Iterator[Any]
+    """
+
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    chunks_it = iter(chunks)
+
+    buf = ""
+    pos = 0
+    eof = False
+
+    def more() -> bool:
+
+        nonlocal buf, pos, eof
+
+        if eof:
+            return False
+
+        data = ""
+
+        for chunk in chunks_it:
+            data = text.decode(chunk)
+            if data:
+                break
+        else:
+            data = text.decode(b"", final=True)
+            eof = True
+
+        buf = buf[pos:] + data
+        pos = 0
+
+        return bool(data)
+
+    def char() -> str:
+
+        nonlocal pos
+
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\n\r":
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not more():
+                return ""
+
+    def expect(c: str) -> None:
+
+        nonlocal pos
+
+        if char() != c:
+            raise ValueError(f"Expected {c!r} at {buf[pos:pos + 32]!r}")
+
+        pos += 1
+
+    def value() -> Any:
+
+        nonlocal pos
+
+        char()
+
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+                # A number cut off by the chunk may yet go on, 1. then 5 say
+                if (
+                    eof
+                    or not isinstance(obj, (int, float))
+                    or isinstance(obj, bool)
+                    or (buf[end:].strip() and buf[end] not in ".eE+-0123456789")
+                ):
+                    pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            more()
+
+    def array() -> Iterator[Any]:
+
+        nonlocal pos
+
+        expect("[")
+
+        if char() == "]":
+            return
+
+        while True:
+            yield value()
+            c = char()
+            pos += 1
+            if c == "]":
+                return
+            if c != ",":
+                raise ValueError(f"Expected ',' or ']' got {c!r}")
+
+    def descend(keys: tuple[str, ...]) -> Iterator[Any]:
+
+        nonlocal pos
+
+        expect("{")
+
+        while char() not in ["}", ""]:
+
+            key = value()
+            expect(":")
+
+            if key == keys[0]:
+                # The rest of the document isn't needed
+                if len(keys) == 1:
+                    yield from array()
+                else:
+                    yield from descend(keys[1:])
+                return
+
+            value()
+
+            if char() == ",":
+                pos += 1
+
+    yield from descend(path)
+
+
+def json_stream(
+    session: requests.Session,
+    url: str,
+    path: tuple[str, ...],
+    timeout: int = REQUEST_TIMEOUT,
+    limiter: Optional[HostLimiter] = None,
+) -> Iterator[Any]:
+    """
+    GET a json document and stream the items of the array at path off the socket.
+    Retries as fetch does until the response starts
+
+    :param session: Session
+    :type session: requests.Session
+    :param url: URL
+    :type url: str
+    :param path: Object keys to the array
+    :type path: tuple[str, ...]
+    :param timeout: timeout, defaults to REQUEST_TIMEOUT
+    :type timeout: int, optional
+    :param limiter: Rate limit and backoff, defaults to None
+    :type limiter: Optional[HostLimiter], optional
+    :raises requests.exceptions.HTTPError: For an error status, once retries are used up
+    :raises requests.exceptions.RequestException: For connection errors, once retries are used up
+    :raises ValueError: For a malformed document
+    :yield: Items of the array
+    :rtype: Iterator[Any]
+    """
+
+    retries = 0
+    host = urlsplit(url).hostname or ""
+
+    while retries < REQUEST_RETRIES_MAX + 1:
+
+        retry_after = None
+
+        if limiter is not None:
+            limiter.acquire(host)
+
+        try:
+            response = session.get(url, timeout=timeout, stream=True)
+
+            if response.status_code in (408, 429, 502, 503, 504):
+
+                response.close()
+                retry_after = response.headers.get("retry-after")
+                ret, retries = retry_logger(
+                    url=url, err=None, status=response.status_code, retries=retries
+                )
+
+                if ret:
+                    raise requests.exceptions.HTTPError(
+                        f"Status {response.status_code} for {url}", response=response
+                    )
+
+            elif response.status_code >= 400:
+
+                response.close()
+                raise requests.exceptions.HTTPError(
+                    f"Status {response.status_code} for {url}", response=response
+                )
+
+            else:
+                break
+
+        except requests.exceptions.HTTPError:
+            raise
+
+        except requests.exceptions.RequestException as err:
+            ret, retries = retry_logger(url=url, err=err, status=None, retries=retries)
+
+            if ret:
+                raise
+
+        if limiter is not None:
+            limiter.backoff(host, retries, retry_after)
+        else:
+            sleep(1 * retries)
+
+    # Past here items have gone out, so errors aren't retried
+    with response:
+        yield from json_items(response.iter_content(chunk_size=REQUEST_CHUNK), path)
+
+
+def map_bounded(
+    executor: Executor,
+    fn: Callable,
+    items: Iterable,
+    window: int,
+    ordered: bool = True,
+) -> Iterator[tuple[Any, Any]]:
+    """
+    Like executor.map but with only window items in flight,
+    so items can be streamed in rather than listed up front
+
+    :param executor: Executor
+    :type executor: Executor
+    :param fn: Called per item
+    :type fn: Callable
+    :param items: Inputs
+    :type items: Iterable
+    :param window: Items in flight
+    :type window: int
+    :param ordered: Yield in input order, else as completed, defaults to True
+    :type ordered: bool, optional
+    :yield: item, result
+    :rtype: Iterator[tuple[Any, Any]]
+    """
+
+    items_it = iter(items)
+
+    if ordered:
+
+        queue: deque = deque()
+
+        for item in items_it:
+            queue.append((item, executor.submit(fn, item)))
+            if len(queue) >= window:
+                item, future = queue.popleft()
+                yield item, future.result()
+
+        while queue:
+            item, future = queue.popleft()
+            yield item, future.result()
+
+    else:
+
+        futures: dict = {}
+
+        for item in items_it:
+            futures[executor.submit(fn, item)] = item
+            if len(futures) >= window:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield futures.pop(future), future.result()
+
+        for future in as_completed(list(futures)):
+            yield futures.pop(future), future.result()
+
+
+def breaker_row(url: str, host: str) -> ResultRow:
+    """
+    Row of a url skipped as its host's breaker is open, never requested
+
+    :param url: URL
+    :type url: str
+    :param host: Its hostname
+    :type host: str
+    :return: The row, method REQUEST_BREAKER_METHOD
+    :rtype: ResultRow
+    """
+
+    logging.error(f"Issue with: {url} | Host unreachable {host}")
+
+    builder = ResponseBuilder()
+    builder.url(url)
+    builder.method(REQUEST_BREAKER_METHOD)
+
+    return builder.row()
+
+
+def fetch(
+    session: requests.Session,
+    url: str,
+    verb: str,
+    timeout: int = REQUEST_TIMEOUT,
+    file_output: Union[Path, str, CsvSink] = None,
+    previous: Optional[dict] = None,
+    limiter: Optional[HostLimiter] = None,
+    breaker: Optional[HostBreaker] = None,
+    max_bytes: Optional[int] = None,
+    headers: Optional[dict] = None,
+    sniff: bool = False,
+    retries: int = 0,
+    defer: bool = False,
+    resource: bool = True,
+) -> ResultRow:
+    """
+    Sync Fetch sa url and write data to file output
+    With a previous row, revalidate it with its etag / last modified,
+    a 304 carries the previous row forward.
+    Sniffing, a HEAD that's refused or declares a generic type is followed by
+    a range GET for the leading bytes, the format is read from those
+
+    :param session: Session
+    :type session: requests.Session
+    :param url: URL
+    :type url: str
+    :param verb: http method
+    :type verb: str
+    :param timeout: timeout, defaults to REQUEST_TIMEOUT
+    :type timeout: int, optional
+    :param file_output: output to a file_, defaults to None
+    :type file_output: Union[Path,str,CsvSink], optional
+    :param previous: Previous run's row for the url, defaults to None
+    :type previous: Optional[dict], optional
+    :param limiter: Per host rate limit and backoff, defaults to None, a fixed sleep between retries
+    :type limiter: Optional[HostLimiter], optional
+    :param breaker: Skip hosts that keep failing to connect, defaults to None
+    :type breaker: Optional[HostBreaker], optional
+    :param max_bytes: Stream the body and keep at most this much of it, defaults to None, all of it
+    :type max_bytes: Optional[int], optional
+    :param headers: Extra request headers, defaults to None
+    :type headers: Optional[dict], optional
+    :param sniff: Range GET to sniff the format where HEAD says little, defaults to False
+    :type sniff: bool, optional
+    :param retries: Retries so far, for a deferred retry, defaults to 0
+    :type retries: int, optional
+    :param defer: The caller takes the limiter token for each attempt and waits out
+        backoff itself, on RetryDeferred, defaults to False
+    :type defer: bool, optional
+    :param resource: A resource check, its body sniffed for the format, False for api calls, defaults to True
+    :type resource: bool, optional
+    :raises Exception: Raise exceptions for retry
+    :raises RetryDeferred: With defer, for a retry once the host's hold is up
+    :return: The result, a row with Response's properties
+    :rtype: ResultRow
+    """
+
+    if previous:
+        headers = {**headers_conditional(previous), **(headers or {})}
+
+    host = urlsplit(url).hostname or ""
+
+    # A deferred retry is already past the breaker
+    if breaker is not None and not retries and not breaker.allow(host):
+
+        result = breaker_row(url, host)
+
+        if file_output:
+            csv_append(file_output, result)
+
+        return result
+
+    while retries < REQUEST_RETRIES_MAX + 1:
+
+        retry_after = None
+
+        if limiter is not None and not defer:
+            limiter.acquire(host)
+
+        timing = timing_start()
+
+        try:
+            response = session.request(
+                method=verb,
+                url=url,
+                allow_redirects=True,
+                timeout=timeout,
+                headers=headers,
+                stream=max_bytes is not None,
+            )
+
+            if breaker is not None:
+                breaker.success(host)
+
+            if response.status_code == 304 and previous:
+
+                response.close()
+
+                # Unchanged, but this request's timings
+                timing_stop(timing, 0)
+                result = ResultRow.from_previous(previous)._replace(
+                    **{f"time_{_}": timing[_] for _ in TIMING_PHASES}, bytes_=0
+                )
+
+                if file_output:
+                    csv_append(file_output, result)
+
+                return result
+
+            elif response.status_code in (408, 429, 502, 503, 504):
+
+                response.close()
+
+                if response.status_code in (429, 503):
+                    retry_after = response.headers.get("retry-after")
+
+                ret, retries = retry_logger(
+                    url=url, err=None, status=response.status_code, retries=retries
+                )
+                if ret:
+
+                    builder = ResponseBuilder()
+                    builder.url(url)
+                    builder.status(response.status_code)
+                    builder.timing(timing_stop(timing))
+
+                    result = builder.row()
+
+                    if file_output:
+                        csv_append(file_output, result)
+
+                    return result
+
+            elif response.status_code:
+
+                builder = ResponseBuilder()
+                builder.url(url)
+                builder.status(response.status_code)
+                builder.method(verb)
+                builder.sniff(resource)
+
+                content = b""
+
+                if verb not in ["HEAD"]:
+                    content = content_read(response, max_bytes)
+                    builder.content(content)
+
+                builder.timing(timing_stop(timing, len(content)))
+                builder.headers(response.headers)
+
+                if response.history:
+                    builder.url(response.history[0].url)
+                    builder.url_redirect(response.url)
+                else:
+                    builder.url(url)
+
+                result = builder.row()
+
+                if (
+                    sniff
+                    and verb in ["HEAD"]
+                    and (
+                        response.status_code in SNIFF_STATUSES
+                        or (
+                            response.ok
+                            and (result.mime_type or "").lower()
+                            in ("",) + MIME_TYPES_GENERIC
+                        )
+                    )
+                ):
+                    # Deferred, no token to hand means the url goes round again
+                    if defer and limiter is not None and limiter.wait(host):
+                        raise RetryDeferred(retries)
+
+                    sniffed = fetch(
+                        session=session,
+                        url=url,
+                        verb="GET",
+                        timeout=timeout,
+                        limiter=limiter,
+                        breaker=breaker,
+                        max_bytes=SNIFF_BYTES,
+                        headers={"Range": f"bytes=0-{SNIFF_BYTES - 1}"},
+                        retries=retries,
+                        defer=defer,
+                    )
+
+                    if not response.ok:
+                        # A refused HEAD takes whatever the GET got, the resource's
+                        # status rather than the range's partial content
+                        if sniffed.status:
+                            result = sniffed._replace(
+                                content=None,  # Only the leading bytes
+                                status=HTTPStatus.OK.value
+                                if sniffed.status == HTTPStatus.PARTIAL_CONTENT
+                                else sniffed.status,
+                            )
+                    elif sniffed.status and 200 <= sniffed.status < 300:
+                        # The HEAD's row, with the format the leading bytes show
+                        result = result._replace(
+                            mime_type_sniffed=sniffed.mime_type_sniffed
+                        )
+
+                if file_output:
+                    csv_append(file_output, result)
+
+                return result
+
+            else:
+                raise Exception
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.RequestException,
+        ) as err:
+            ret, retries = retry_logger(url=url, err=err, status=None, retries=retries)
+
+            if isinstance(err, REQUEST_ERRORS_FINAL):
+                ret = True  # Never sent, so nothing learnt of the host either
+                if breaker is not None:
+                    breaker.release(host)
+            elif breaker is not None:
+                if isinstance(err, requests.exceptions.ConnectionError):
+                    # Give up on the url too once the host is open
+                    ret = breaker.failure(host) or ret
+                else:
+                    breaker.success(host)  # It answered, if slowly
+
+        if ret:
+
+            builder = ResponseBuilder()
+            builder.url(url)
+            builder.timing(timing_stop(timing))  # How long it took to give up
+
+            result = builder.row()
+
+            if file_output:
+                csv_append(file_output, result)
+
+            return result
+
+        if limiter is not None:
+            limiter.backoff(host, retries, retry_after)
+            if defer:
+                raise RetryDeferred(retries)
+        else:
+            sleep(1 * retries)
+
+    builder = ResponseBuilder()
+    builder.url(url)
+
+    result = builder.row()
+
+    return result
+
+
+def session_mount(
+    session: requests.Session, concurrency: int, concurrency_host: int
+) -> requests.Session:
+    """
+    Size the session connection pools for concurrent use
+
+    :param session: Session
+    :type session: requests.Session
+    :param concurrency: Hosts to keep pools for
+    :type concurrency: int
+    :param concurrency_host: Connections kept per host
+    :type concurrency_host: int
+    :return: Session
+    :rtype: requests.Session
+    """
+
+    adapter = TimedAdapter(pool_connections=concurrency, pool_maxsize=concurrency_host)
+
+    for scheme in ["http://", "https://"]:
+        session.mount(scheme, adapter)
+
+    return session
+
+
+async def fetch_async(
+    session: requests.Session,
+    urls: Iterable[str],
+    verb: str,
+    timeout: int = REQUEST_TIMEOUT,
+    file_output: Union[Path, str, CsvSink] = None,
+    concurrency: int = REQUEST_CONCURRENCY,
+    concurrency_host: int = REQUEST_CONCURRENCY_HOST,
+    previous: Optional[dict[str, dict]] = None,
+    limiter: Optional[HostLimiter] = None,
+    breaker: Optional[HostBreaker] = None,
+    max_bytes: Optional[int] = REQUEST_MAX_BYTES,
+    sniff: bool = False,
+) -> int:
+    """
+    Async fetch of many urls, bounded overall and per host.
+    urls are queued by host and each host gets concurrency_host workers,
+    started a round of hosts at a time, so hosts share the slots in turn
+    whatever order the urls come in.
+    Each url goes through fetch in a worker thread, rows are written
+    from the event loop so there is a single writer to file output
+
+    :param session: Session
+    :type session: requests.Session
+    :param urls: URLs
+    :type urls: Iterable[str]
+    :param verb: http method
+    :type verb: str
+    :param timeout: timeout, defaults to REQUEST_TIMEOUT
+    :type timeout: int, optional
+    :param file_output: output to a file_, defaults to None
+    :type file_output: Union[Path,str,CsvSink], optional
+    :param concurrency: In flight requests, defaults to REQUEST_CONCURRENCY
+    :type concurrency: int, optional
+    :param concurrency_host: In flight requests per host, defaults to REQUEST_CONCURRENCY_HOST
+    :type concurrency_host: int, optional
+    :param previous: Previous rows by url to revalidate, defaults to None
+    :type previous: Optional[dict[str, dict]], optional
+    :param limiter: Per host rate limit and backoff, defaults to HostLimiter()
+    :type limiter: Optional[HostLimiter], optional
+    :param breaker: Skip hosts that keep failing to connect, defaults to HostBreaker()
+    :type breaker: Optional[HostBreaker], optional
+    :param max_bytes: Body kept per url, streamed and cut off, defaults to REQUEST_MAX_BYTES
+    :type max_bytes: Optional[int], optional
+    :param sniff: Range GET to sniff the format where HEAD says little, defaults to False
+    :type sniff: bool, optional
+    :return: Count of urls fetched
+    :rtype: int
+    """
+
+    loop = asyncio.get_running_loop()
+
+    limiter_host = limiter or HostLimiter(burst=concurrency_host)
+
+    breaker_host = breaker or HostBreaker()
+
+    session_mount(session, concurrency, concurrency_host)
+
+    # Waiters are served in turn, so the slots go round the hosts
+    slots = asyncio.Semaphore(concurrency)
+
+    queues: dict[str, deque] = {}
+    for url in urls:
+        queues.setdefault(urlsplit(url).hostname or "", deque()).append(url)
+
+    count = 0
+
+    async def worker(host: str, queue: deque, executor: ThreadPoolExecutor) -> None:
+
+        nonlocal count
+
+        while queue:
+
+            url = queue.popleft()
+            retries = 0
+
+            # Skipped straight away, not after waiting on a token for a host that's down
+            if breaker_host.is_open(host):
+                result = breaker_row(url, host)
+                if file_output:
+                    csv_append(file_output, result, keys=[url])
+                count += 1
+                continue
+
+            while True:
+
+                # Rate and backoff waits happen here, holding no slot
+                wait = limiter_host.wait(host)
+                while wait:
+                    await asyncio.sleep(wait)
+                    wait = limiter_host.wait(host)
+
+                try:
+                    async with slots:
+                        result = await loop.run_in_executor(
+                            executor,
+                            partial(
+                                fetch,
+                                session=session,
+                                url=url,
+                                verb=verb,
+                                timeout=timeout,
+                                previous=previous.get(url) if previous else None,
+                                limiter=limiter_host,
+                                breaker=breaker_host,
+                                max_bytes=max_bytes,
+                                sniff=sniff,
+                                retries=retries,
+                                defer=True,
+                            ),
+                        )
+                    break
+                except RetryDeferred as deferred:
+                    retries = deferred.retries
+
+            if file_output:
+                csv_append(file_output, result, keys=[url])
+
+            count += 1
+
+            # Let the waiter just woken take the slot before this worker asks again
+            await asyncio.sleep(0)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        # A worker per host first, then a second and so on, up to concurrency_host
+        await asyncio.gather(
+            *(
+                worker(host, queue, executor)
+                for _ in range(concurrency_host)
+                for host, queue in queues.items()
+                if len(queue) > _
+            )
+        )
+
+    return count
+
+
+def json_process(dct: dict) -> list[dict]:
+    """
+    Process fields of interest into a dict from ckan response
+    Takes package_show, package_search and current_package_list_with_resources results
+    #TODO possibly model this as a class
+    :param dct: _description_
+    :type dct: dict
+    :return: _description_
+    :rtype: list[dict]
+    """
+
+    def dct_package(dct: dict) -> dict:
+
+        measure_dct = {
+            _: None
+            for _ in [
+                "Update",
+                "Format",
+                "Metadata",
+                "License",
+                "Data dictionary",
+                "Availability",
+                "Historic",
+                "API",
+            ]
+        }
+
+        for _ in [
+            "license_title",
+            "maintainer",
+            "maintainer_email",
+            "license_id",
+            "author",
+            "author_email",
+        ]:
+            measure_dct[_] = dct.get(_)
+
+        for _ in ["id"]:
+            measure_dct[f"_package_{_}"] = dct.get(_)
+
+        for _ in data.get("extras", []):
+            if dct.get("key", None) == "Frequência de atualização":
+                measure_dct["Update"] = dct.get("value")
+
+        return measure_dct
+
+    measure_lst: list[dict] = []
+
+    result = dct.get("result")
+
+    datas: list
+
+    if isinstance(result, list):  # current_package_list_with_resources
+        datas = result
+    elif isinstance(result, dict) and "results" in result:  # package_search
+        datas = result["results"]
+    else:
+        datas = [result]
+
+    for data in datas:
+
+        dct_pack = dct_package(data)
+
+        for _ in data.get("resources", []):
+
+            dct_resource = deepcopy(dct_pack)
+
+            for fieldname in [
+                "id",
+                "last_modified",
+                "format",
+                "created",
+                "url",
+                "state",
+                "mimetype",
+                "url_type",
+                "resource_type",
+                "name",
+            ]:
+
+                dct_resource[fieldname] = _.get(fieldname)
+
+            measure_lst.append(dct_resource)
+
+    return measure_lst
+
+
+def package_show(
+    session: requests.Session,
+    package_id: str,
+    timeout: int = REQUEST_TIMEOUT,
+    limiter: Optional[HostLimiter] = None,
+) -> Optional[list[dict]]:
+    """
+    Get a package and process it into resource rows
+
+    :param session: Session
+    :type session: requests.Session
+    :param package_id: ckan package id or name
+    :type package_id: str
+    :param timeout: timeout, defaults to REQUEST_TIMEOUT
+    :type timeout: int, optional
+    :param limiter: Rate limit and backoff, defaults to None
+    :type limiter: Optional[HostLimiter], optional
+    :return: Rows as per json_process, None if nothing came back
+    :rtype: Optional[list[dict]]
+    """
+
+    datas = fetch(
+        session=session,
+        url=f"{URL_BASE}/action/package_show?id={package_id}",
+        verb="GET",
+        timeout=timeout,
+        limiter=limiter,
+        resource=False,
+    )
+
+    if datas.content:
+        # API contract is pretty stable, hence no error checking
+        return json_process(json.loads(datas.content))
+
+    return None
+
+
+def package_pages(
+    session: requests.Session,
+    mode: str = "search",
+    page_size: int = REQUEST_PAGE_SIZE,
+    timeout: int = REQUEST_TIMEOUT,
+    offset: int = 0,
+    limiter: Optional[HostLimiter] = None,
+) -> Iterator[dict]:
+    """
+    Page through packages with their resources,
+    package_search (rows/start) or current_package_list_with_resources (limit/offset).
+    Pages are parsed as they stream in, a package at a time
+
+    :param session: Session
+    :type session: requests.Session
+    :param mode: search or list, defaults to "search"
+    :type mode: str, optional
+    :param page_size: Packages asked for per page, defaults to REQUEST_PAGE_SIZE
+    :type page_size: int, optional
+    :param timeout: timeout, defaults to REQUEST_TIMEOUT
+    :type timeout: int, optional
+    :param offset: Package to start from, defaults to 0
+    :type offset: int, optional
+    :param limiter: Rate limit and backoff, defaults to None
+    :type limiter: Optional[HostLimiter], optional
+    :yield: Packages
+    :rtype: Iterator[dict]
+    """
+
+    while True:
+
+        if mode == "search":
+            # Sort so pages are stable while paging
+            url = f"{URL_BASE}/action/package_search?rows={page_size}&start={offset}&sort=name%20asc"
+            path: tuple[str, ...] = ("result", "results")
+        else:
+            url = f"{URL_BASE}/action/current_package_list_with_resources?limit={page_size}&offset={offset}"
+            path = ("result",)
+
+        count = 0
+
+        for package in json_stream(
+            session, url, path, timeout=timeout, limiter=limiter
+        ):
+            count += 1
+            yield package
+
+        # Portals may cap the page size below what was asked for,
+        # so only an empty page ends it
+        if not count:
+            return
+
+        offset += count
+
+
+def ckan_api(
+    session: requests.Session = None,
+    workers: int = REQUEST_WORKERS,
+    ordered: bool = True,
+    mode: str = "show",
+    page_size: int = REQUEST_PAGE_SIZE,
+    resume: bool = False,
+    output_format: str = "csv",
+    partition: Optional[str] = None,
+) -> requests.Session:
+    """
+    Call the ckan API
+
+    :param session: With a requests session, defaults to None
+    :type session: requests.session, optional
+    :param workers: package_show workers sharing the session, defaults to REQUEST_WORKERS
+    :type workers: int, optional
+    :param ordered: Write packages in package_list order, else as they arrive, defaults to True
+    :type ordered: bool, optional
+    :param mode: show for package_list then package_show per id,
+        search / list to page through package_search / current_package_list_with_resources,
+        defaults to "show"
+    :type mode: str, optional
+    :param page_size: Packages per page for search / list, defaults to REQUEST_PAGE_SIZE
+    :type page_size: int, optional
+    :param resume: Skip packages journalled by an earlier run and append, defaults to False
+    :type resume: bool, optional
+    :param output_format: csv or parquet, defaults to "csv"
+    :type output_format: str, optional
+    :param partition: Parquet partitioned by host or date, defaults to None
+    :type partition: Optional[str], optional
+    """
+
+    timeout = 3600
+
+    if mode not in ["show", "search", "list"]:
+        raise ValueError(f"Unknown mode {mode}")
+
+    if session is None:
+
+        session = requests.Session()
+        session.headers.update({"User-Agent": USER_AGENT})
+
+    os.makedirs(DIRECTORY_DATA, exist_ok=True)
+
+    # Write some target fields out, specced in json_process
+
+    file_output = Path(f"{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}.{output_format}")
+    fieldnames = [
+        "Update",
         "Format",
         "Metadata",
         "License",
@@ -516,127 +3173,744 @@ def ckan_api(session: requests.Session = None) -> requests.Session:
         "resource_type",
         "name",
     ]
-    with open(file_output, mode="w") as fp:
-        writer = csv.DictWriter(fp, fieldnames=fieldnames)
-        writer.writeheader()
+    idx = 0
+
+    # Back off the api when it throttles, no rate limit of our own
+    limiter = HostLimiter(rate=None)
+
+    # Packages are journalled by name, as package_list gives them
+    sink = sink_open(
+        file_output,
+        fieldnames,
+        resume=resume,
+        output_format=output_format,
+        partition=partition,
+    )
+    done = sink.journal
+
+    with sink:
+
+        if done.completed:
+            logging.info(f"Nothing to resume for {file_output}")
+            return session
+
+        paged = False
+
+        if mode in ["search", "list"]:
+
+            try:
+                # Step back a page on resume, packages already done are filtered out
+                for idx, package in enumerate(
+                    package_pages(
+                        session,
+                        mode=mode,
+                        page_size=page_size,
+                        timeout=timeout,
+                        offset=max(0, len(done) - page_size),
+                        limiter=limiter,
+                    ),
+                    1,
+                ):
+                    if package.get("name") not in done:
+                        sink.write(
+                            json_process({"result": package}),
+                            keys=[package.get("name")],
+                        )
+
+            except (requests.exceptions.RequestException, ValueError) as err:
+                if idx:
+                    raise  # Part way through, resume from here
+                logging.error(f"Issue with: {mode} paging | Err {err}")
+
+            paged = idx > 0
+
+            if paged:
+                logging.info(f"Packages paged {idx}")
+            else:
+                # Nothing paged, fall back to per id
+                logging.error(
+                    f"Paging with {mode} failed, falling back to package_show"
+                )
+
+        if not paged:
+
+            # Parsed as it streams in, the body is never held whole
+            package_ids = [
+                _
+                for _ in json_stream(
+                    session,
+                    f"{URL_BASE}/action/package_list",
+                    ("result",),
+                    timeout=timeout,
+                    limiter=limiter,
+                )
+                if _ not in done
+            ]
+
+            session_mount(session, workers, workers)
+
+            worker = partial(package_show, session, timeout=timeout, limiter=limiter)
+
+            # Workers only fetch and parse, this thread is the single writer.
+            # A bounded window keeps finished packages from piling up behind a slow one
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+
+                for idx, (package_id, rows) in enumerate(
+                    map_bounded(
+                        executor, worker, package_ids, workers * 4, ordered=ordered
+                    )
+                ):
+                    # Failures aren't journalled so a resume retries them
+                    if rows is not None:
+                        sink.write(rows, keys=[package_id])
+
+            logging.info(f"Rows extracted {idx}")
+
+    done.complete()
+
+    return session
+
+
+def ckan_url(
+    session: requests.Session = None,
+    concurrency: int = REQUEST_CONCURRENCY,
+    concurrency_host: int = REQUEST_CONCURRENCY_HOST,
+    revalidate: bool = False,
+    resume: bool = False,
+    rate_host: Optional[float] = REQUEST_RATE_HOST,
+    sniff: bool = False,
+    output_format: str = "csv",
+    partition: Optional[str] = None,
+    shard: Optional[tuple[int, int]] = None,
+) -> requests.Session:
+    """
+    Get urls from a list if available, else call api to generate one
+    Then loop through checking status, encoding etc
+
+    :param session: Optional session, defaults to None
+    :type session: requests.session, optional
+    :param concurrency: In flight requests, defaults to REQUEST_CONCURRENCY
+    :type concurrency: int, optional
+    :param concurrency_host: In flight requests per host, defaults to REQUEST_CONCURRENCY_HOST
+    :type concurrency_host: int, optional
+    :param revalidate: Revalidate the previous run's results, unchanged rows carry forward, defaults to False
+    :type revalidate: bool, optional
+    :param resume: Skip urls journalled by an earlier run and append,
+        an unfinished ckan_api harvest is resumed too, defaults to False
+    :type resume: bool, optional
+    :param rate_host: Requests per second per host, None for no limit, defaults to REQUEST_RATE_HOST
+    :type rate_host: Optional[float], optional
+    :param sniff: Range GET to sniff the format where HEAD is refused or says little, defaults to False
+    :type sniff: bool, optional
+    :param output_format: csv or parquet, input read in the same, defaults to "csv"
+    :type output_format: str, optional
+    :param partition: Parquet partitioned by host or date, defaults to None
+    :type partition: Optional[str], optional
+    :param shard: Check only the hosts of shard i of n, written to its own files, defaults to None
+    :type shard: Optional[tuple[int, int]], optional
+    """
+
+    if session is None:
+
+        session = requests.Session()
+        session.headers.update({"User-Agent": USER_AGENT})
+
+    file_url = Path(f"{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}.{output_format}")
+    if shard is not None and file_url.exists() is False:
+        # Shards running side by side would each harvest into the same file
+        raise FileNotFoundError(f"Harvest {file_url} with api before sharding")
+    elif file_url.exists() is False:
+        ckan_api(resume=resume, output_format=output_format, partition=partition)
+    elif resume and Path(f"{file_url}.journal").is_file():
+        # Returns straight away if it completed
+        ckan_api(
+            session, resume=resume, output_format=output_format, partition=partition
+        )
 
-    for idx, _ in enumerate(json.loads(data_dct["_content"])["result"]):
+    os.makedirs(f"_{DIRECTORY_DATA}", exist_ok=True)
+    os.makedirs(DIRECTORY_MAPPING, exist_ok=True)
+
+    suffix = shard_suffix(shard)
+
+    file_output = Path(
+        f"_{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}{suffix}.{output_format}"
+    )
+    file_mapping = Path(f"{DIRECTORY_MAPPING}/{sys.argv[0].split('/')[-1]}{suffix}.csv")
+
+    # Read before the output is truncated
+    previous = rows_previous(file_output) if revalidate else None
+
+    sink = sink_open(
+        file_output,
+        Response.__slots__,
+        resume=resume,
+        output_format=output_format,
+        partition=partition,
+    )
+    done = sink.journal
+
+    with sink:
 
-        url = f"{URL_BASE}/action/package_show?id={_}"
-        datas = fetch(
-            session=session,
-            url=url,
-            verb="GET",
-            timeout=timeout,
+        urls_tmp = sorted(
+            {
+                _["url"] or ""  # Parquet has nulls where csv has empty strings
+                for _ in rows_read(file_url, ["url"])
+            }
         )
 
-        if datas["_content"]:
-            # API contract is pretty stable, hence no error checking
-            csv_append(
-                file_output, json_process(json.loads(datas["_content"])), fieldnames
+        # Variants of a url are checked once, under their canonical key
+        urls_tmp = [
+            _ for _ in urls_canonical(urls_tmp, file_mapping, shard) if _ not in done
+        ]
+
+        # Prescreen for malformed up front
+        directories, rejects = urls_prescreen(urls_tmp, ["http", "https"], url_screen)
+
+        uris_log(rejects, sink)
+
+        urls = [url for _ in directories.values() for url in _]
+
+        asyncio.run(
+            fetch_async(
+                session=session,
+                urls=urls,
+                verb="HEAD",
+                file_output=sink,
+                concurrency=concurrency,
+                concurrency_host=concurrency_host,
+                previous=previous,
+                limiter=HostLimiter(rate=rate_host, burst=concurrency_host),
+                sniff=sniff,
             )
+        )
+
+    done.complete()
 
-    logging.info(f"Rows extracted {idx}")
+    timings_summary(
+        file_output,
+        Path(f"_{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}{suffix}_timings.csv"),
+    )
 
     return session
 
 
-def ckan_url(session: requests.Session = None) -> requests.Session:
+def url_percent(value: str) -> str:
     """
-    Get urls from a list if available, else call api to generate one
-    Then loop through checking status, encoding etc
+    Percent encoding in one form, escapes of unreserved characters decoded,
+    the rest upper case, characters that need it (spaces, unicode...) encoded
 
-    :param session: Optional session, defaults to None
-    :type session: requests.session, optional
+    :param value: path or query
+    :type value: str
+    :return: Normalised
+    :rtype: str
     """
 
-    if session is None:
+    def escape(match: re.Match) -> str:
+        char = chr(int(match.group(1), 16))
+        return char if char in URL_UNRESERVED else f"%{match.group(1).upper()}"
 
-        session = requests.Session()
-        session.headers.update({"User-Agent": USER_AGENT})
+    return quote(URL_PERCENT_PATTERN.sub(escape, value), safe=URL_SAFE)
 
-    file_url = Path(f"{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}.csv")
-    if file_url.is_file() is False:
-        ckan_api()
 
-    os.makedirs(f"_{DIRECTORY_DATA}", exist_ok=True)
+def url_canonical(url: str) -> str:
+    """
+    Canonical key for a url, variants of one resource share it.
+    Lower case scheme and host, IDNA host, no default port,
+    one percent encoding, no trailing slash, no fragment
 
-    file_output = Path(f"_{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}.csv")
-    with open(file_output, mode="w") as fp:
-        writer = csv.DictWriter(fp, fieldnames=Response.__slots__)
-        writer.writeheader()
+    :param url: URL
+    :type url: str
+    :return: Canonical url, the url itself if it won't parse
+    :rtype: str
+    """
 
-    urls_tmp: list[str] = []
-    urls: list[str] = []
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except (ValueError, AttributeError):
+        return url
 
-    with open(file_url) as f:
-        _ = list({_["url"] for _ in list(csv.DictReader(f))})
-        if _:
-            urls_tmp = _.sort()
+    scheme = parts.scheme.lower()
+    host = parts.hostname
 
-    for _ in urls_tmp:  # Prescreen for malformed up front
+    if not scheme or not host:
+        return url
 
-        raisenwrite = False
+    with suppress(UnicodeError):
+        host = host.encode("idna").decode("ascii")
 
-        try:
-            url = URL(_)
-            if len(url.host) > 64 or url.port is None:
-                raisenwrite = True
-            else:
-                urls.append(_)
-        except (ValueError, TypeError, UnicodeError):
-            raisenwrite = True
+    if ":" in host:  # ipv6
+        host = f"[{host}]"
 
-        if raisenwrite:
-            logging.error(f"Issue with {_}")
-            builder = ResponseBuilder()
-            builder.url(url)
-            built = builder.build()
-            csv_append(
-                file_output,
-                {attr: getattr(built, attr, None) for attr in built.__slots__},
-            )
+    netloc = host if port in [None, URL_PORTS_DEFAULT.get(scheme)] else f"{host}:{port}"
 
-    for url in urls:
-        fetch(
-            session=session,
-            url=url,
-            verb="HEAD",
-            file_output=file_output,
+    if "@" in parts.netloc:
+        netloc = f"{parts.netloc.rpartition('@')[0]}@{netloc}"
+
+    path = url_percent(parts.path).rstrip("/") or "/"
+
+    return urlunsplit((scheme, netloc, path, url_percent(parts.query), ""))
+
+
+def urls_canonical(
+    urls: Iterable[str],
+    file_mapping: Union[Path, str],
+    shard: Optional[tuple[int, int]] = None,
+) -> list[str]:
+    """
+    Map urls to their canonical keys, so each is checked once.
+    The mapping is written url,url_canonical so results fan back out to every resource
+
+    :param urls: URLs
+    :type urls: Iterable[str]
+    :param file_mapping: Mapping file
+    :type file_mapping: Union[Path, str]
+    :param shard: Keep only the keys of shard i of n, defaults to None, all of them
+    :type shard: Optional[tuple[int, int]], optional
+    :return: Canonical keys, in input order
+    :rtype: list[str]
+    """
+
+    keys: dict[str, None] = {}
+    count = 0
+
+    with open(file_mapping, "w") as fp:
+
+        writer = csv.writer(fp)
+        writer.writerow(["url", "url_canonical"])
+
+        for url in urls:
+            key = url_canonical(url)
+            if shard is not None and url_shard(key, shard[1]) != shard[0]:
+                continue
+            keys[key] = None
+            writer.writerow([url, key])
+            count += 1
+
+    logging.info(f"Urls {count} canonical {len(keys)}")
+
+    return list(keys)
+
+
+def shard_parse(value: str) -> tuple[int, int]:
+    """
+    Parse a shard, i/n with i counted from 0
+
+    :param value: Shard, as 0/4
+    :type value: str
+    :raises ValueError: For anything but 0 <= i < n
+    :return: i, n
+    :rtype: tuple[int, int]
+    """
+
+    index, _, count = value.partition("/")
+
+    shard = (int(index), int(count))
+
+    if not 0 <= shard[0] < shard[1]:
+        raise ValueError(f"Shard {value} not in 0/n to n-1/n")
+
+    return shard
+
+
+def shard_suffix(shard: Optional[tuple[int, int]]) -> str:
+    """
+    Suffix of a shard's output files, so shards run side by side
+
+    :param shard: i, n, None for an unsharded run
+    :type shard: Optional[tuple[int, int]]
+    :return: Suffix, empty unsharded
+    :rtype: str
+    """
+
+    return "" if shard is None else f".shard-{shard[0]}-of-{shard[1]}"
+
+
+def url_shard(url: str, shards: int) -> int:
+    """
+    Shard of a url, by a stable hash of its host so every url of a host
+    lands in the same shard and per host limits still hold across shards
+
+    :param url: URL
+    :type url: str
+    :param shards: Shards
+    :type shards: int
+    :return: Shard, 0 to shards - 1
+    :rtype: int
+    """
+
+    try:
+        host = (urlsplit(url).hostname or "").encode("utf-8", "surrogatepass")
+    except ValueError:
+        host = b""  # Malformed, all land together to be logged
+
+    return (
+        int.from_bytes(hashlib.blake2b(host, digest_size=8).digest(), "little") % shards
+    )
+
+
+def url_screen(url: str) -> Optional[str]:
+    """
+    Full parse of a url for the http checker, yarl.
+    Other schemes, ftp and the like, are left to the uri checker
+
+    :param url: URL
+    :type url: str
+    :return: Its directory, None if malformed or not http
+    :rtype: Optional[str]
+    """
+
+    from yarl import URL  # TODO just use URI package buuut IDNA handling?
+
+    try:
+        parsed = URL(url)
+        if (
+            parsed.scheme not in ["http", "https"]
+            or parsed.host is None
+            or len(parsed.host) > 64
+            or parsed.port is None
+        ):
+            return None
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+    return URL_DIRECTORY_PATTERN.sub("", url)
+
+
+def uri_screen(url: str) -> Optional[str]:
+    """
+    Full parse of a uri of any scheme, urlsplit
+
+    :param url: URI
+    :type url: str
+    :return: Its directory, None if malformed
+    :rtype: Optional[str]
+    """
+
+    try:
+        parts = urlsplit(url)
+        parts.port  # Raises for one out of range or not a number
+    except ValueError:
+        return None
+
+    if not parts.scheme or parts.hostname is None or len(parts.hostname) > 64:
+        return None
+
+    # Use this for ftp dir, improve dns
+    return URL_DIRECTORY_PATTERN.sub("", url)
+
+
+def urls_prescreen(
+    urls: Iterable[str],
+    schemes: Iterable[str],
+    screen: Callable[[str], Optional[str]],
+) -> tuple[dict[str, list[str]], list[str]]:
+    """
+    Prescreen a column of urls for malformed, at once with vectorised regex.
+    Plain urls of the given schemes pass on the pattern alone,
+    only the leftovers (unicode, ipv6, odd schemes...) go through screen
+
+    :param urls: URLs
+    :type urls: Iterable[str]
+    :param schemes: Lower case schemes the pattern is trusted for
+    :type schemes: Iterable[str]
+    :param screen: Full parser for the leftovers, the directory or None if malformed
+    :type screen: Callable[[str], Optional[str]]
+    :return: URLs by directory in input order, malformed URLs
+    :rtype: tuple[dict[str, list[str]], list[str]]
+    """
+
+    import pandas as pd
+
+    series = pd.Series(list(urls), dtype=object)
+
+    directories: dict[str, list[str]] = {}
+    rejects: list[str] = []
+
+    if series.empty:
+        return directories, rejects
+
+    parts = series.str.extract(URL_PATTERN)
+    host_length = parts["host"].str.len()
+
+    rejected = host_length > 64
+    clean = (
+        parts["scheme"].str.lower().isin(list(schemes))
+        & ~rejected
+        & (parts["port"].astype(float).fillna(0) <= 65535)
+    )
+    for url, url_directory, is_rejected in zip(
+        series, parts["directory"].where(clean), rejected
+    ):
+
+        if is_rejected:
+            rejects.append(url)
+            continue
+
+        if not isinstance(url_directory, str):  # A leftover
+            url_directory = screen(url)
+            if url_directory is None:
+                rejects.append(url)
+                continue
+
+        directories.setdefault(url_directory, []).append(url)
+
+    return directories, rejects
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Nearest rank percentile
+
+    :param values: Sorted values
+    :type values: list[float]
+    :param p: Percentile, 0 to 100
+    :type p: float
+    :return: Value
+    :rtype: float
+    """
+
+    return values[max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def timings_summary(
+    file_input: Union[Path, str], file_summary: Union[Path, str], top: int = 10
+) -> list[dict]:
+    """
+    p50 / p95 / p99 of request timings by host and status, from a run's results.
+    Written to file_summary, the slowest hosts and each status printed
+
+    :param file_input: Results, Response.__slots__ columns
+    :type file_input: Union[Path, str]
+    :param file_summary: Summary csv
+    :type file_summary: Union[Path, str]
+    :param top: Slowest hosts printed, defaults to 10
+    :type top: int, optional
+    :return: Summary rows
+    :rtype: list[dict]
+    """
+
+    columns = [f"_time_{_}" for _ in TIMING_PHASES]
+
+    # (host, status): [values per phase], arrays keep millions of timings small
+    groups: dict[tuple[str, str], list[array]] = {}
+
+    for row in rows_read(file_input, ["_url", "_status"] + columns):
+
+        key = (urlsplit(row["_url"] or "").hostname or "", str(row["_status"] or ""))
+
+        if key not in groups:
+            groups[key] = [array("d") for _ in columns]
+
+        for values, column in zip(groups[key], columns):
+            if row[column] not in [None, ""]:
+                values.append(float(row[column]))
+
+    summary: list[dict] = []
+
+    for (host, status), phases in groups.items():
+
+        row_dct: dict[str, Any] = {
+            "host": host,
+            "status": status,
+            "count": len(phases[-1]),
+        }
+
+        for phase, values in zip(TIMING_PHASES, phases):
+            values_sorted = sorted(values)
+            for p in [50, 95, 99]:
+                row_dct[f"{phase}_p{p}"] = (
+                    percentile(values_sorted, p) if values_sorted else None
+                )
+
+        summary.append(row_dct)
+
+    summary.sort(key=lambda _: _["total_p95"] or 0.0, reverse=True)
+
+    with open(file_summary, "w") as fp:
+        writer = csv.DictWriter(
+            fp,
+            fieldnames=["host", "status", "count"]
+            + [f"{_}_p{p}" for _ in TIMING_PHASES for p in [50, 95, 99]],
         )
+        writer.writeheader()
+        writer.writerows(summary)
 
-    return session
+    by_status: dict[str, array] = {}
+
+    for (host, status), phases in groups.items():
+        by_status.setdefault(status, array("d")).extend(phases[-1])
+
+    print("status   count    p50    p95    p99")
+    for status, values in sorted(by_status.items()):
+        if values:
+            values_sorted = sorted(values)
+            print(
+                f"{status or '-':>6} {len(values):>7} "
+                + " ".join(
+                    f"{percentile(values_sorted, p):>6.2f}" for p in [50, 95, 99]
+                )
+            )
 
+    print(f"slowest hosts by total p95, all in {file_summary}")
+    for _ in summary[:top]:
+        if _["total_p95"] is not None:
+            print(
+                f"{_['host']} {_['status'] or '-'} n={_['count']} "
+                f"p50={_['total_p50']:.2f} p95={_['total_p95']:.2f} p99={_['total_p99']:.2f}"
+            )
+
+    return summary
 
-def uris_log(uris: list[URI], file_output: Path) -> None:
+
+def uris_log(uris: Iterable[str], file_output: Union[Path, str, CsvSink]) -> None:
     # TODO add status code in here perhaps
     # For additional diagnostics
     """
-    Log a list of URI classes
+    Log a list of uris as issues
 
-    :param uris: list of URI classes
-    :type uris: list[URI]
+    :param uris: uris
+    :type uris: Iterable[str]
     :param file_output: file to send to
-    :type file_output: str
+    :type file_output: Union[Path, str, CsvSink]
     """
 
     for _ in uris:
-        logging.error(f"Issue with {_.uri}")
+        logging.error(f"Issue with {_}")
         builder = ResponseBuilder()
-        builder.url(_.uri)
-        built = builder.build()
-        csv_append(
-            file_output,
-            {attr: getattr(built, attr, None) for attr in built.__slots__},
+        builder.url(_)
+        csv_append(file_output, builder.row(), keys=[_])
+
+
+def ftp_check(
+    pool: FtpPool,
+    uri_by_paths: list[str],
+    sans_qry_fragment: str,
+    file_output: Union[Path, str, CsvSink],
+    breaker: Optional[HostBreaker] = None,
+) -> None:
+    """
+    Check ftp uris in one directory exist, from its listing
+
+    :param pool: Connections and listings
+    :type pool: FtpPool
+    :param uri_by_paths: uris in the directory
+    :type uri_by_paths: list[str]
+    :param sans_qry_fragment: The directory, as a uri
+    :type sans_qry_fragment: str
+    :param file_output: file to send to
+    :type file_output: Union[Path, str, CsvSink]
+    :param breaker: Skip hosts that keep failing to connect, defaults to None
+    :type breaker: Optional[HostBreaker], optional
+    """
+
+    # Parsed once, the directory's connection details are shared
+    parts = urlsplit(uri_by_paths[0])
+    host = parts.hostname or ""
+
+    # Canonical uris are percent encoded, the server wants the names as they are
+    path = unquote(parts.path).rpartition("/")[0] or "/"
+
+    if breaker is not None and not breaker.allow(host):
+        uris_log(uri_by_paths, file_output)
+        return
+
+    # One listing answers the whole directory, each row gets its timings
+    timing = timing_start()
+
+    try:
+        listing = pool.listing(
+            host=host,
+            path=path,
+            port=parts.port,
+            user=unquote(parts.username) if parts.username else None,
+            passwd=unquote(parts.password) if parts.password else None,
         )
 
+    except ftplib.all_errors as e:
+        logging.error(f"Issue with: {sans_qry_fragment} | Err {e}")
+        if breaker is not None and isinstance(e, (OSError, EOFError)):
+            breaker.failure(host)
+        uris_log(uri_by_paths, file_output)
+        return
+
+    if breaker is not None:
+        breaker.success(host)
+
+    timing_stop(timing)
+
+    # Just check file exists in expected location
+
+    for _ in uri_by_paths:
+
+        file = listing.get(unquote(urlsplit(_).path).rpartition("/")[2])
+
+        if file is None:
+            uris_log([_], file_output)
+            continue
+
+        # Guess the file type and encoding, could download and inspect
+        # Buut FTP likely to be deprecated in future
+        mime_type, encoding = mimetypes.guess_type(_)
+
+        headers: CaseInsensitiveDict[str] = CaseInsensitiveDict()
+
+        if mime_type:
+            headers["content-type"] = (
+                f"{mime_type};{encoding}" if encoding else mime_type
+            )
+
+        if file.get("timestamp"):
+            headers["last-modified"] = formatdate(file["timestamp"], usegmt=True)
 
-def ckan_uri_scheme(session: requests.Session = None) -> bool:
+        builder = ResponseBuilder()
+        builder.url(_)
+        builder.status(200)
+        builder.headers(headers)
+        # Its size from the listing, the bytes a RETR would send
+        builder.timing({**timing, "bytes": file["size"]})
+
+        if file["url_redirect"]:
+            builder.url_redirect(file["url_redirect"])
+
+        csv_append(file_output, builder.row())
+
+
+def ckan_uri_scheme(
+    session: requests.Session = None,
+    concurrency: int = REQUEST_CONCURRENCY,
+    concurrency_host: int = REQUEST_CONCURRENCY_HOST,
+    revalidate: bool = False,
+    resume: bool = False,
+    rate_host: Optional[float] = REQUEST_RATE_HOST,
+    sniff: bool = False,
+    output_format: str = "csv",
+    partition: Optional[str] = None,
+    shard: Optional[tuple[int, int]] = None,
+) -> bool:
     """
     Get endpoints from any scheme, should be deprecated whne ftp removed
     # TODO return FTP status codes
     :param session: _description_, defaults to None
     :type session: requests.Session, optional
+    :param concurrency: In flight http requests, defaults to REQUEST_CONCURRENCY
+    :type concurrency: int, optional
+    :param concurrency_host: In flight http requests per host, defaults to REQUEST_CONCURRENCY_HOST
+    :type concurrency_host: int, optional
+    :param revalidate: Revalidate the previous run's http results, unchanged rows carry forward, defaults to False
+    :type revalidate: bool, optional
+    :param resume: Skip uris journalled by an earlier run and append, defaults to False
+    :type resume: bool, optional
+    :param rate_host: Requests per second per http host, None for no limit, defaults to REQUEST_RATE_HOST
+    :type rate_host: Optional[float], optional
+    :param sniff: Range GET to sniff the format where HEAD is refused or says little, defaults to False
+    :type sniff: bool, optional
+    :param output_format: csv or parquet, input read in the same, defaults to "csv"
+    :type output_format: str, optional
+    :param partition: Parquet partitioned by host or date, defaults to None
+    :type partition: Optional[str], optional
+    :param shard: Check only the hosts of shard i of n, written to its own files, defaults to None
+    :type shard: Optional[tuple[int, int]], optional
     :raises Exception: _description_
     :raises Exception: _description_
     :raises Exception: _description_
@@ -645,198 +3919,456 @@ def ckan_uri_scheme(session: requests.Session = None) -> bool:
     :rtype: bool
     """
 
-    file_input = Path(f"{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}.csv")
+    file_input = Path(f"{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}.{output_format}")
 
-    file_output = Path(f"_{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}.csv")
+    suffix = shard_suffix(shard)
 
-    os.makedirs(DIRECTORY_DATA, exist_ok=True)
+    file_output = Path(
+        f"_{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}{suffix}.{output_format}"
+    )
+    file_mapping = Path(f"{DIRECTORY_MAPPING}/{sys.argv[0].split('/')[-1]}{suffix}.csv")
 
-    with open(file_output, mode="w") as fp:
-        writer = csv.DictWriter(fp, fieldnames=Response.__slots__)
-        writer.writeheader()
+    os.makedirs(f"_{DIRECTORY_DATA}", exist_ok=True)
+    os.makedirs(DIRECTORY_MAPPING, exist_ok=True)
+
+    # Read before the output is truncated
+    previous = rows_previous(file_output) if revalidate else None
+
+    sink = sink_open(
+        file_output,
+        Response.__slots__,
+        resume=resume,
+        output_format=output_format,
+        partition=partition,
+    )
+    done = sink.journal
 
-    urls: list = []
-    uris: dict = {}
+    with sink:
 
-    with open(file_input) as f:
         # erroneously described as urls but stores uri's
-        urls = list({_["url"] for _ in list(csv.DictReader(f))})
+        urls = list(
+            {
+                _["url"] or ""  # Parquet has nulls where csv has empty strings
+                for _ in rows_read(file_input, ["url"])
+            }
+        )
 
-    for _ in urls:  # Prescreen for malformed up front
+        # Variants of a uri are checked once, under their canonical key
+        urls = [_ for _ in urls_canonical(urls, file_mapping, shard) if _ not in done]
 
-        raisenwrite = False
+        # Prescreen for malformed up front, grouped by directory
+        uris, rejects = urls_prescreen(urls, ["http", "https", "ftp"], uri_screen)
 
-        try:
-            # https://github.com/marrow/uri
-            uri_posit = URI(_)
+        uris_log(rejects, sink)
 
-        except ValueError:
+        if session is None:
+            # Could check read of file for http / https,
+            # but just setup here
+            session = requests.Session()
+            session.headers.update({"User-Agent": USER_AGENT})
 
-            raisenwrite = True
+        # We use this to infer encoding / type in ftp , again could check we have some requests L712
+        mimetypes.init()
 
-        if (uri_posit.scheme is None or uri_posit.hostname is None) or (
-            len(uri_posit.hostname) > 64
-        ):
+        urls_http: list[str] = []
 
-            raisenwrite = True
+        breaker = HostBreaker()
 
-        else:
-            # Use this for ftp dir, improve dns
-            sans_qry_fragment = "/".join(uri_posit.uri.split("/")[:-1])
+        # Control connections and listings are shared across directories on a host
+        with FtpPool() as pool:
 
-            try:
-                uri_posit.scheme.name
-            except AttributeError:
-                raisenwrite = True
+            for sans_qry_fragment, uri_by_paths in uris.items():
 
-            if raisenwrite is False:
+                scheme: str = urlsplit(uri_by_paths[0]).scheme.lower()
 
-                if sans_qry_fragment not in uris:
-                    uris[sans_qry_fragment] = []
+                if scheme in ["ftp"]:
 
-                uris[sans_qry_fragment].append(uri_posit)
+                    ftp_check(pool, uri_by_paths, sans_qry_fragment, sink, breaker)
 
-        if raisenwrite:
-            logging.error(f"Issue with {_}")
-            builder = ResponseBuilder()
-            builder.url(_)
-            built = builder.build()
-            csv_append(
-                file_output,
-                {attr: getattr(built, attr, None) for attr in built.__slots__},
+                elif scheme in ["http", "https"]:
+                    # Checked together below, grouped by directory so hosts stay adjacent
+                    urls_http.extend(uri_by_paths)
+                else:
+                    uris_log(uri_by_paths, sink)
+
+        asyncio.run(
+            fetch_async(
+                session=session,
+                urls=urls_http,
+                verb="HEAD",
+                file_output=sink,
+                concurrency=concurrency,
+                concurrency_host=concurrency_host,
+                previous=previous,
+                limiter=HostLimiter(rate=rate_host, burst=concurrency_host),
+                breaker=breaker,
+                sniff=sniff,
             )
+        )
 
-    if session is None:
-        # Could check read of file for http / https,
-        # but just setup here
-        session = requests.Session()
-        session.headers.update({"User-Agent": USER_AGENT})
+    done.complete()
 
-    # We use this to infer encoding / type in ftp , again could check we have some requests L712
-    mimetypes.init()
+    timings_summary(
+        file_output,
+        Path(f"_{DIRECTORY_DATA}/{sys.argv[0].split('/')[-1]}{suffix}_timings.csv"),
+    )
 
-    for sans_qry_fragment, uri_by_paths in uris.items():
+    return True
 
-        uri: URI = uri_by_paths[0]
 
-        scheme: str = uri.scheme.name.strip()
+def ckan_merge(
+    shards: int, output_format: str = "csv", partition: Optional[str] = None
+) -> int:
+    """
+    Merge the results and mappings of a sharded check into the files
+    an unsharded run writes, once every shard has completed
+
+    :param shards: Shards the check ran as
+    :type shards: int
+    :param output_format: csv or parquet, as the shards, defaults to "csv"
+    :type output_format: str, optional
+    :param partition: Parquet partitioned by host or date, defaults to None
+    :type partition: Optional[str], optional
+    :raises ValueError: For a shard missing or not completed
+    :return: Rows merged
+    :rtype: int
+    """
 
-        if scheme in ["ftp"]:
+    name = sys.argv[0].split("/")[-1]
 
-            if (
-                re.search("ftp://ftp.hfa.mil.br", str(uri_by_paths[0].uri), re.DOTALL)
-                is None
-            ):
-                continue
+    file_output = Path(f"_{DIRECTORY_DATA}/{name}.{output_format}")
+    file_mapping = Path(f"{DIRECTORY_MAPPING}/{name}.csv")
 
-            # We just get first domain / path and search for files
-            hasconnect = False
+    files = [
+        (
+            Path(
+                f"_{DIRECTORY_DATA}/{name}{shard_suffix((_, shards))}.{output_format}"
+            ),
+            Path(f"{DIRECTORY_MAPPING}/{name}{shard_suffix((_, shards))}.csv"),
+        )
+        for _ in range(shards)
+    ]
 
-            try:
-                ftp = ftplib.FTP(
-                    host=uri.host,
-                    user=uri.username if uri.username else None,
-                    passwd=uri.password if uri.password else None,
-                    # https://bugs.python.org/issue30956
-                    timeout=REQUEST_TIMEOUT,
-                )
-                ftp.login()
-                hasconnect = True
+    # All or nothing, a partial merge would read as a finished run
+    for file_shard, _ in files:
+        file_journal = Path(f"{file_shard}.journal")
+        if not (
+            file_journal.is_file() and Checkpoint(file_journal, resume=True).completed
+        ):
+            raise ValueError(
+                f"Shard {file_shard} not completed, rerun it with --resume"
+            )
 
-            except ftplib.all_errors as e:
+    count = 0
 
-                if isinstance(e, socket.timeout):  # Not sure this is the best way
+    sink = sink_open(
+        file_output,
+        Response.__slots__,
+        output_format=output_format,
+        partition=partition,
+    )
 
-                    uris_log(uri_by_paths, file_output)
+    with sink:
+        for file_shard, _ in files:
+            for row in rows_read(file_shard):
+                sink.write(row)
+                count += 1
 
-                else:
-                    raise
+    sink.journal.complete()
 
-            if hasconnect is True:  # TODO handle this better from above
+    with open(file_mapping, "w") as fp:
 
-                files_dct: dict = {}
-                dir_list: list[str] = []
+        writer = csv.writer(fp)
+        writer.writerow(["url", "url_canonical"])
 
-                try:
-                    # Capture transient errors here
-                    if str(uri.path.parent) != "/":
-                        ftp.cwd(uri.path.parent)
+        for _, file_shard in files:
+            with open(file_shard) as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                writer.writerows(reader)
 
-                    ftp.retrlines("LIST", dir_list.append)  # 'MLSD'?
+    logging.info(f"Merged {shards} shards, rows {count}")
 
-                except ftplib.all_errors:  # TODO to broad here
-                    uris_log(uri_by_paths, file_output)
+    timings_summary(file_output, Path(f"_{DIRECTORY_DATA}/{name}_timings.csv"))
 
-                ftp.quit()
+    return count
 
-                parser = ftpparser.FTPParser()
-
-                # name, size, timestamp, isdirectory, downloadable, islink, permissions
-                files_dct = {
-                    f"{sans_qry_fragment}/{_[0]}": {
-                        "name": _[0],
-                        "size": _[1],
-                        "timestamp": _[2],
-                        "url_redirect": _[5],
-                    }
-                    for _ in parser.parse(dir_list)
-                    if _[3] == 0 and _[4] == 1
-                }
 
-                # Guess the file type and encoding, could download and inspect
-                # Buut FTP likely to be deprecated in future
-                for _ in files_dct:
-                    (
-                        files_dct[_]["mime_type"],
-                        files_dct[_]["encoding"],
-                    ) = mimetypes.guess_type(_)
-
-                # Just check file exists in expected location
-
-                for _ in uri_by_paths:
-
-                    if _.uri in files_dct:
-
-                        file = files_dct[_.uri]
-                        builder = ResponseBuilder()
-                        builder.url(_.uri)
-                        builder.status(200)
-                        builder.headers(
-                            CaseInsensitiveDict(
-                                {
-                                    "content-type": f"{file.get('mime_type','')};{file.get('encoding','')}",
-                                    "last_modified": file.get("timestamp", ""),
-                                }
-                            )
-                        )
+def url_digest(url: str) -> int:
+    """
+    Compact key for a url, a small int holds in much less memory than the string
+
+    :param url: URL
+    :type url: str
+    :return: 64 bit digest
+    :rtype: int
+    """
 
-                        if files_dct[_.uri]["url_redirect"]:
-                            builder.url_redirect(files_dct[_.uri]["url_redirect"])
+    return int.from_bytes(
+        hashlib.blake2b(url.encode("utf-8", "surrogatepass"), digest_size=8).digest(),
+        "little",
+    )
 
-                        built = builder.build()
 
-                        out_dct = {
-                            attr: getattr(built, attr, None) for attr in built.__slots__
-                        }
+def ckan_score(
+    output_format: str = "csv", partition: Optional[str] = None
+) -> dict[str, int]:
+    """
+    Join link check results into the resource table, filling Availability,
+    with Availability aggregated per package alongside.
+    Results are hashed by canonical url, then the resource table is streamed
+    through once, so neither table is held whole
+
+    :param output_format: csv or parquet, as the inputs, defaults to "csv"
+    :type output_format: str, optional
+    :param partition: Parquet partitioned by host or date, defaults to None
+    :type partition: Optional[str], optional
+    :return: Resources, checked and available counts
+    :rtype: dict[str, int]
+    """
+
+    name = sys.argv[0].split("/")[-1]
+
+    file_resources = Path(f"{DIRECTORY_DATA}/{name}.{output_format}")
+    file_results = Path(f"_{DIRECTORY_DATA}/{name}.{output_format}")
+    file_output = Path(f"_{DIRECTORY_DATA}/{name}_resources.{output_format}")
+    file_packages = Path(f"_{DIRECTORY_DATA}/{name}_packages.{output_format}")
+
+    # Build side, the smaller table, only a digest and a status per url
+    statuses: dict[int, Optional[int]] = {}
+
+    for _ in rows_read(file_results, ["_url", "_status"]):
+        status_text = str(_.get("_status") or "")
+        statuses[url_digest(_["_url"] or "")] = (
+            int(status_text) if status_text.isdigit() else None
+        )
+
+    logging.info(f"Results {len(statuses)}")
+
+    # Resources, checked, available, per package
+    packages: dict[str, list[int]] = {}
+    counts = {"resources": 0, "checked": 0, "available": 0}
 
-                        if file_output:
-                            csv_append(file_output, out_dct)
-                    else:
-                        uris_log([_], file_output)
-
-        elif scheme in ["http", "https"]:
-            for url in uri_by_paths:
-                fetch(
-                    session=session,
-                    url=url.uri,
-                    verb="HEAD",
-                    file_output=file_output,
+    fieldnames: Optional[list[str]] = None
+    sink: Optional[CsvSink] = None
+
+    try:
+        # Probe side, streamed
+        for row in rows_read(file_resources):
+
+            if sink is None:
+                fieldnames = list(row.keys())
+                sink = sink_open(
+                    file_output,
+                    fieldnames,
+                    output_format=output_format,
+                    partition=partition,
+                    journal=False,
                 )
-        else:
-            uris_log(uri_by_paths, file_output)
 
-    return True
+            counts_package = packages.setdefault(
+                row.get("_package_id") or "", [0, 0, 0]
+            )
+            counts_package[0] += 1
+            counts["resources"] += 1
+
+            key = url_digest(url_canonical(row.get("url") or ""))
+
+            if key in statuses:
+
+                status_code = statuses[key]
+                available = int(status_code is not None and 200 <= status_code < 400)
+
+                row["Availability"] = available
+
+                counts_package[1] += 1
+                counts_package[2] += available
+                counts["checked"] += 1
+                counts["available"] += available
+
+            sink.write(row)
+
+    finally:
+        if sink is not None:
+            sink.close()
+
+    with sink_open(
+        file_packages,
+        ["_package_id", "resources", "checked", "available", "Availability"],
+        output_format=output_format,
+        journal=False,
+    ) as sink_packages:
+        for package_id, (resources, checked, available) in packages.items():
+            sink_packages.write(
+                {
+                    "_package_id": package_id,
+                    "resources": resources,
+                    "checked": checked,
+                    "available": available,
+                    "Availability": round(available / checked, 4) if checked else None,
+                }
+            )
+
+    logging.info(f"Scored {counts}")
+
+    return counts
+
+
+def shards_run(shards: int, argv: list[str]) -> None:
+    """
+    Run a check as shards side by side, one process each on this machine.
+    Across machines run each --shard i/n by hand, then merge
+
+    :param shards: Shards
+    :type shards: int
+    :param argv: Arguments of the check, --shards dropped
+    :type argv: list[str]
+    :raises ChildProcessError: For a shard that failed, rerun it with --resume
+    """
+
+    # Drop --shards n / --shards=n, each shard gets its --shard i/n
+    argv_shard: list[str] = []
+    skip = False
+    for _ in argv:
+        if skip:
+            skip = False
+        elif _ == "--shards":
+            skip = True
+        elif not _.startswith("--shards="):
+            argv_shard.append(_)
+
+    processes = [
+        subprocess.Popen(
+            [sys.executable, sys.argv[0], *argv_shard, "--shard", f"{_}/{shards}"]
+        )
+        for _ in range(shards)
+    ]
+
+    failed = [_ for _, process in enumerate(processes) if process.wait() != 0]
+
+    if failed:
+        raise ChildProcessError(f"Shards {failed} of {shards} failed")
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """
+    Command line, harvest the ckan api or check its resource urls
+
+    :param argv: Arguments, defaults to sys.argv
+    :type argv: Optional[list[str]], optional
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="uri_scheme",
+        choices=["api", "url", "uri_scheme", "merge", "score"],
+        help="Harvest the api, check http urls, check urls of any scheme, "
+        "merge a sharded check, or score availability from the checks",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip work journalled by an interrupted run and append to its output",
+    )
+    parser.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="Conditionally recheck the previous run's results",
+    )
+    parser.add_argument("--mode", default="show", choices=["show", "search", "list"])
+    parser.add_argument("--page-size", type=int, default=REQUEST_PAGE_SIZE)
+    parser.add_argument("--workers", type=int, default=REQUEST_WORKERS)
+    parser.add_argument(
+        "--unordered", action="store_true", help="Write packages as they arrive"
+    )
+    parser.add_argument("--concurrency", type=int, default=REQUEST_CONCURRENCY)
+    parser.add_argument(
+        "--concurrency-host", type=int, default=REQUEST_CONCURRENCY_HOST
+    )
+    parser.add_argument(
+        "--rate-host",
+        type=float,
+        default=REQUEST_RATE_HOST,
+        help="Requests per second per host, 0 for no limit",
+    )
+    parser.add_argument(
+        "--sniff",
+        action="store_true",
+        help="Range GET the leading bytes where HEAD is refused or the type is generic",
+    )
+    parser.add_argument(
+        "--format",
+        default="csv",
+        choices=["csv", "parquet"],
+        help="Output format, parquet needs pyarrow, the parquet extra",
+    )
+    parser.add_argument(
+        "--partition",
+        choices=["host", "date"],
+        help="Partition parquet output by url host or run date",
+    )
+
+    parser.add_argument(
+        "--shard",
+        type=shard_parse,
+        help="Check only shard i/n of the hosts, i from 0, into its own files",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="Check as n shards in local processes, then merge, or shards to merge",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.shards and args.command in ["url", "uri_scheme"]:
+        shards_run(args.shards, sys.argv[1:] if argv is None else argv)
+        ckan_merge(args.shards, output_format=args.format, partition=args.partition)
+        return
+
+    if args.command == "api":
+        ckan_api(
+            workers=args.workers,
+            ordered=not args.unordered,
+            mode=args.mode,
+            page_size=args.page_size,
+            resume=args.resume,
+            output_format=args.format,
+            partition=args.partition,
+        )
+    elif args.command == "score":
+        ckan_score(output_format=args.format, partition=args.partition)
+    elif args.command == "merge":
+        if not args.shards:
+            parser.error("merge needs --shards")
+        ckan_merge(args.shards, output_format=args.format, partition=args.partition)
+    elif args.command == "url":
+        ckan_url(
+            concurrency=args.concurrency,
+            concurrency_host=args.concurrency_host,
+            revalidate=args.revalidate,
+            resume=args.resume,
+            rate_host=args.rate_host or None,
+            sniff=args.sniff,
+            output_format=args.format,
+            partition=args.partition,
+            shard=args.shard,
+        )
+    else:
+        ckan_uri_scheme(
+            concurrency=args.concurrency,
+            concurrency_host=args.concurrency_host,
+            revalidate=args.revalidate,
+            resume=args.resume,
+            rate_host=args.rate_host or None,
+            sniff=args.sniff,
+            output_format=args.format,
+            partition=args.partition,
+            shard=args.shard,
+        )
 
 
 if __name__ == "__main__":
-    ckan_uri_scheme()
+    main()
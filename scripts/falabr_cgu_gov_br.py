@@ -2,25 +2,52 @@
 Analysis of data requests/complaints from interested parties at falabr.cgu.gov.br
 """
 
-import io
+import hashlib
+import importlib.util
 import json
+import logging
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
 from pathlib import Path
-from typing import Optional
-from zipfile import ZipFile
+from typing import Any, Iterable, Optional
+from zipfile import BadZipFile, ZipFile
 
-import numpy as np
-import pandas as pd
 import requests
-from pandas_profiling import ProfileReport
-from tqdm import tqdm
 
-pd.options.display.width = 0
+# numpy, pandas, pandas_profiling and tqdm are imported where used, fetching needs none
 
 URL_BASE = "https://falabr.cgu.gov.br/publico/DownloadDados/"
 DATA_DIRECTORY = f"data/{sys.argv[0].split('/')[-1]}"
+DOWNLOAD_BASE = "https://dadosabertos-download.cgu.gov.br/FalaBR/Arquivos_FalaBR/"
+DOWNLOAD_FILETYPES = ["Pedidos_csv", "Recursos_Reclamacoes_csv"]  # Archive per year
+DOWNLOAD_DIRECTORY = f"{DATA_DIRECTORY}/archives"
+DOWNLOAD_STATE = f"{DATA_DIRECTORY}/downloads.json"  # ETag / Last-Modified by url
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_CHUNK = 2**20  # Bytes written at a time
+DOWNLOAD_TIMEOUT = 60  # Seconds
+DATE_WIDTH = 19  # dd/mm/yyyy hh:mm:ss, the widest of the usual dates
+DATE_YEARS = (1678, 2261)  # Whole years pandas holds in ns
+BOOLEAN_VALUES = (["Sim"], ["Não"])  # True, false, grab these from locale or data dict?
+# Data dictionary format, matched from the start ignoring case, first match wins
+DICTIONARY_DTYPES = [
+    (r"(?:inteiro|n[uú]mero inteiro)\b", "Int64"),
+    (r"(?:decimal|num[eé]rico|n[uú]mero|real|moeda|valor)\b", "Float64"),
+    (r"(?:booleano|l[oó]gico|sim/n[aã]o)\b", "boolean"),
+    (
+        r"(?:texto|string|varchar|caracteres?|alfanum[eé]rico)\s*(?:\(\s*(?P<width>\d+)\s*\))?",
+        "category",
+    ),
+]
+CATEGORY_WIDTH = 255  # Declared wider text is free text, read as string
+CATEGORY_SHARE = 0.5  # More distinct values than this share of rows, string
+CACHE_DIRECTORY = f"{DATA_DIRECTORY}/cache"
+CACHE_VERSION = (
+    1  # Bump when file_read reads differently other than by the settings below
+)
+CACHE_CHUNK = 2**20  # Bytes hashed at a time
 
 
 def clear_data(directory: str) -> None:
@@ -38,12 +65,611 @@ def clear_data(directory: str) -> None:
                 item.unlink()
 
 
-def get_data() -> None:
+def dates_parse(dates: Iterable[str]) -> Any:
+    """
+    Forgiving parse of dd/mm/yyyy[ hh:mm:ss] dates, anything else is NaT.
+    Each distinct value is parsed once, the usual two shapes as whole columns
+    of digits, the odd ones one by one
+
+    :param dates: Date strings
+    :type dates: Iterable[str]
+    :return: Dates, tz agnostic
+    :rtype: pd.DatetimeIndex
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(pd.Series(dates, dtype=object))
+    uniques = uniques.to_numpy()
+
+    # Code points less "0", digits 0 to 9, whatever is past DATE_WIDTH cut,
+    # and past the end of a value -ord("0")
+    points = uniques.astype(f"U{DATE_WIDTH + 1}").view(np.uint32).reshape(
+        len(uniques), DATE_WIDTH + 1
+    ).astype(np.int32) - ord("0")
+    digits = (points >= 0) & (points <= 9)
+
+    def number(*positions: int) -> Any:
+        return sum(
+            points[:, _] * 10 ** (len(positions) - 1 - i)
+            for i, _ in enumerate(positions)
+        )
+
+    # Separators can be anything
+    dated = digits[:, [0, 1, 3, 4, 6, 7, 8, 9]].all(axis=1) & (
+        points[:, 10] == -ord("0")
+    )
+    timed = (
+        digits[:, [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15, 17, 18]].all(axis=1)
+        & (points[:, 13] == ord(":") - ord("0"))
+        & (points[:, 16] == ord(":") - ord("0"))
+        & (points[:, 19] == -ord("0"))
+    )
+
+    year = number(6, 7, 8, 9)
+    month = number(3, 4)
+    day = number(0, 1)
+    hour, minute, second = (np.where(timed, number(_, _ + 1), 0) for _ in (11, 14, 17))
+
+    months = (np.clip(year, *DATE_YEARS) - 1970) * 12 + np.clip(month, 1, 12) - 1
+    months = months.astype("datetime64[M]")
+    month_days = (months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")
+
+    # Out of range anything goes the slow way, to whatever numpy and pandas make of it
+    usual = (
+        (dated | timed)
+        & (year >= DATE_YEARS[0])
+        & (year <= DATE_YEARS[1])
+        & (month >= 1)
+        & (month <= 12)
+        & (day >= 1)
+        & (day <= month_days.astype(np.int64))
+        & (hour < 24)
+        & (minute < 60)
+        & (second < 60)
+    )
+
+    parsed = np.full(len(uniques) + 1, np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    # tz agnsotic at present though https://en.wikipedia.org/wiki/Time_in_Brazil
+    parsed[:-1][usual] = (
+        (months.astype("datetime64[D]") + day - 1).astype("datetime64[s]")
+        + hour * 3600
+        + minute * 60
+        + second
+    )[usual]
+
+    odd: list[np.datetime64] = []
+    for dat in map(str, uniques[~usual]):
+        date_bit = f"{dat[6:10]}-{dat[3:5]}-{dat[0:2]}"
+        time_bit = dat[11:] if dat[11:] else "00:00:00"
+        try:
+            odd.append(np.datetime64(f"{date_bit}T{time_bit}"))
+        except ValueError:
+            odd.append(np.datetime64("NaT"))
+    parsed[:-1][~usual] = pd.to_datetime(
+        pd.Series(odd, dtype=object), errors="coerce"
+    ).to_numpy()
+
+    # Missing values are coded -1, the NaT on the end
+    return pd.DatetimeIndex(parsed[codes])
+
+
+def dtypes_compile(fields: dict) -> tuple[dict[str, str], list[str]]:
+    """
+    Data dictionary fields to read_csv dtypes, short text as category until
+    frame_tidy sees how many values it has, formats it doesn't know left to pandas
+
+    :param fields: Data dictionary fields, fieldname, format and description
+    :type fields: dict
+    :return: dtypes by column and the date columns
+    :rtype: tuple[dict[str, str], list[str]]
+    """
+
+    dtypes: dict[str, str] = {}
+    dates: list[str] = []
+
+    for field in fields.values():
+
+        if field["format"][:5] == "Data ":
+            dates.append(field["fieldname"])
+            continue
+
+        for pattern, dtype in DICTIONARY_DTYPES:
+            match = re.match(pattern, field["format"], re.IGNORECASE)
+            if match is None:
+                continue
+
+            if dtype == "category" and int(match.group("width") or 0) > CATEGORY_WIDTH:
+                dtype = "string"
+            elif dtype == "category" and re.search(
+                r"\bSim\b.+\bN[aã]o\b", field["description"]
+            ):
+                dtype = "boolean"
+
+            dtypes[field["fieldname"]] = dtype
+            break
+
+    return dtypes, dates
+
+
+def blanks_find(values: Any) -> Any:
+    """
+    Empty or whitespace only, as ^\\s*$ without a regex per value
+
+    :param values: Text
+    :type values: pd.Series
+    :return: Which are blank
+    :rtype: np.ndarray
+    """
+
+    return ((values.str.len() == 0) | values.str.isspace()).to_numpy(
+        dtype=bool, na_value=False
+    )
+
+
+def frame_tidy(df: Any) -> Any:
+    """
+    Blank text to missing, then text categories that turn out not to be,
+    Sim / Não as boolean and near unique values as string
+
+    :param df: Frame as read
+    :type df: pd.DataFrame
+    :return: Same frame
+    :rtype: pd.DataFrame
+    """
+
+    import numpy as np
+
+    for column in df.columns:
+
+        values = df[column]
+
+        if values.dtype == "category":
+            categories = values.cat.categories
+            blanks = categories[blanks_find(categories.to_series().astype(str))]
+            if len(blanks):
+                values = values.cat.remove_categories(blanks)
+
+            if len(values.cat.categories) and set(values.cat.categories) <= set(
+                BOOLEAN_VALUES[0] + BOOLEAN_VALUES[1]
+            ):
+                values = values.map(
+                    {_: _ in BOOLEAN_VALUES[0] for _ in values.cat.categories}
+                ).astype("boolean")
+            elif len(values.cat.categories) > CATEGORY_SHARE * len(values):
+                values = values.astype("string")
+
+            df[column] = values
+
+        elif values.dtype == "string":
+            df[column] = values.mask(blanks_find(values))
+
+        elif values.dtype == "object":
+            df[column] = values.replace(r"^\s*$", np.nan, regex=True)
+
+    return df
+
+
+def frames_concat(frames: list) -> Any:
+    """
+    Concatenate frames, categories united first so they stay categories
+
+    :param frames: Frames with the same columns
+    :type frames: list[pd.DataFrame]
+    :return: One frame
+    :rtype: pd.DataFrame
+    """
+
+    import pandas as pd
+    from pandas.api.types import union_categoricals
+
+    for column in frames[0].columns:
+        if all(_[column].dtype == "category" for _ in frames):
+            categories = union_categoricals(
+                [_[column] for _ in frames], ignore_order=True
+            ).categories
+            for _ in frames:
+                _[column] = _[column].cat.set_categories(categories)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def cache_key(file: Path, fields: dict) -> str:
+    """
+    Cache entry name for a csv read with these fields and the current settings
+
+    :param file: csv
+    :type file: Path
+    :param fields: Data dictionary fields for the file
+    :type fields: dict
+    :return: Hex digest
+    :rtype: str
+    """
+
+    settings = [
+        CACHE_VERSION,
+        str(file.resolve()),
+        fields,
+        BOOLEAN_VALUES,
+        DICTIONARY_DTYPES,
+        CATEGORY_WIDTH,
+        CATEGORY_SHARE,
+        DATE_WIDTH,
+        DATE_YEARS,
+    ]
+
+    return hashlib.blake2b(
+        json.dumps(settings, ensure_ascii=False).encode(), digest_size=16
+    ).hexdigest()
+
+
+def file_digest(file: Path) -> str:
+    """
+    Content hash of a file
+
+    :param file: File
+    :type file: Path
+    :return: Hex digest
+    :rtype: str
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(file, "rb") as f:
+        for chunk in iter(partial(f.read, CACHE_CHUNK), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def cache_read(cache: str, file: Path, fields: dict) -> Any:
     """
-    get_data _summary_
+    Frame cached for a csv, if the csv is the same size and modified time,
+    or failing that the same content, as when it was cached
+
+    :param cache: Cache directory
+    :type cache: str
+    :param file: csv
+    :type file: Path
+    :param fields: Data dictionary fields for the file
+    :type fields: dict
+    :return: Frame, None if there is none
+    :rtype: Optional[pd.DataFrame]
     """
 
-    clear_data(DATA_DIRECTORY)
+    import pandas as pd
+
+    entry = Path(cache) / cache_key(file, fields)
+
+    try:
+        with open(f"{entry}.json") as f:
+            source = json.load(f)
+
+        stat = file.stat()
+
+        if source["size"] != stat.st_size:
+            return None
+
+        if source["mtime_ns"] != stat.st_mtime_ns:
+            # Touched, say extracted again, is it changed
+            if source["digest"] != file_digest(file):
+                return None
+            source["mtime_ns"] = stat.st_mtime_ns
+            with open(f"{entry}.json", "w") as f:
+                json.dump(source, f)
+
+        return pd.read_parquet(f"{entry}.parquet")
+
+    except (ImportError, OSError, KeyError, TypeError, ValueError):
+        return None
+
+
+def cache_write(cache: str, file: Path, fields: dict, df: Any) -> None:
+    """
+    Cache the frame read from a csv, parquet as it keeps the dtypes
+
+    :param cache: Cache directory
+    :type cache: str
+    :param file: csv
+    :type file: Path
+    :param fields: Data dictionary fields for the file
+    :type fields: dict
+    :param df: Frame
+    :type df: pd.DataFrame
+    """
+
+    entry = Path(cache) / cache_key(file, fields)
+
+    os.makedirs(cache, exist_ok=True)
+
+    try:
+        # Parquet first, an entry only counts once its json is there
+        df.to_parquet(f"{entry}.parquet.tmp", index=False)
+        os.replace(f"{entry}.parquet.tmp", f"{entry}.parquet")
+    except (ImportError, TypeError, ValueError) as e:
+        logging.error(f"{file} not cached, {e}")
+        return
+
+    stat = file.stat()
+    source = {
+        "file": str(file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "digest": file_digest(file),
+    }
+
+    with open(f"{entry}.json.tmp", "w") as f:
+        json.dump(source, f)
+    os.replace(f"{entry}.json.tmp", f"{entry}.json")
+
+
+def cache_prune(cache: str, keys: set[str]) -> None:
+    """
+    Remove cache entries other than these, for files gone or settings changed
+
+    :param cache: Cache directory
+    :type cache: str
+    :param keys: Entries to keep
+    :type keys: set[str]
+    """
+
+    for item in Path(cache).glob("*"):
+        if item.is_file() and item.name.split(".")[0] not in keys:
+            item.unlink()
+
+
+def file_read(file: Path, fields: dict, cache: Optional[str] = None) -> Any:
+    """
+    Read one FalaBR csv, typed by its data dictionary
+
+    :param file: csv, UTF-16 and ; delimited
+    :type file: Path
+    :param fields: Data dictionary fields for the file
+    :type fields: dict
+    :param cache: Cache directory, defaults to None, no cache
+    :type cache: Optional[str], optional
+    :return: Frame
+    :rtype: pd.DataFrame
+    """
+
+    import pandas as pd
+
+    if cache:
+        df = cache_read(cache, file, fields)
+        if df is not None:
+            return df
+
+    names = [_["fieldname"] for _ in fields.values()]
+    dtypes, dates = dtypes_compile(fields)
+
+    # Hack for some ragged columns not spec'd in data dictionary, or with delimiter not enclosed with quoting
+    # """names.extend(["ragged1", "ragged2", "ragged3"])""""
+    # Added warn
+    # For _Pedidos_csv  file pattern looks like data dictionary columns don't align with csv's
+
+    read_csv = partial(
+        pd.read_csv,
+        file,
+        index_col=False,
+        encoding="UTF-16",
+        names=names,
+        delimiter=";",
+        on_bad_lines="warn",
+        true_values=BOOLEAN_VALUES[0],
+        false_values=BOOLEAN_VALUES[1],
+        parse_dates=dates,
+        date_parser=dates_parse,
+    )
+
+    try:
+        df = read_csv(dtype=dtypes)
+    except (TypeError, ValueError) as e:
+        # Values not as the dictionary says, those columns left to pandas
+        logging.error(f"{file} not as its data dictionary, {e}")
+        df = read_csv(
+            dtype={k: v for k, v in dtypes.items() if v in ("category", "string")}
+        )
+
+    frame_tidy(df)
+
+    if cache:
+        cache_write(cache, file, fields, df)
+
+    return df
+
+
+def frames_read(
+    files: list[Path],
+    headers: dict,
+    workers: Optional[int] = None,
+    cache: Optional[str] = None,
+) -> dict[str, list[tuple[Path, Any]]]:
+    """
+    Read the csvs a process per core, each with the data dictionary its
+    name starts with, from the cache where unchanged
+
+    :param files: csvs, named date_filetype_..._year.csv
+    :type files: list[Path]
+    :param headers: Data dictionary fields by filetype prefix
+    :type headers: dict
+    :param workers: Processes, defaults to None, one per core
+    :type workers: Optional[int], optional
+    :param cache: Cache directory, defaults to None, no cache
+    :type cache: Optional[str], optional
+    :return: Files and their frames by filetype, in the order of files
+    :rtype: dict[str, list[tuple[Path, pd.DataFrame]]]
+    """
+
+    if cache and importlib.util.find_spec("pyarrow") is None:
+        logging.error("Frames not cached, the cache needs pyarrow, the parquet extra")
+        cache = None
+
+    jobs = [
+        (filetype, file, fields)
+        for file in files
+        for filetype in [file.name[9:].split("_")[0]]
+        for prefix, fields in headers.items()
+        if re.search(f"^{prefix}", filetype)
+    ]
+
+    frames: dict[str, list[tuple[Path, Any]]] = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(file_read, file, fields, cache) for _, file, fields in jobs
+        ]
+
+        for (filetype, file, _), future in zip(jobs, futures):
+            frames.setdefault(filetype, []).append((file, future.result()))
+
+    if cache:
+        cache_prune(cache, {cache_key(file, fields) for _, file, fields in jobs})
+
+    return frames
+
+
+def archive_fetch(
+    session: requests.Session, url: str, directory: str, state: dict
+) -> Optional[dict]:
+    """
+    Download an archive to disk a chunk at a time, unless unchanged since
+    the state was recorded
+
+    :param session: Session
+    :type session: requests.Session
+    :param url: Archive url
+    :type url: str
+    :param directory: Where archives are kept
+    :type directory: str
+    :param state: ETag and Last-Modified from the last download, if any
+    :type state: dict
+    :return: ETag and Last-Modified of this download, None if unchanged
+    :rtype: Optional[dict]
+    """
+
+    archive = Path(directory) / url.split("/")[-1]
+
+    headers = {}
+
+    # Without the archive any answer has to be the whole thing
+    if archive.is_file():
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
+    with session.get(
+        url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+    ) as response:
+
+        if response.status_code == 304:
+            return None
+
+        response.raise_for_status()
+
+        with open(f"{archive}.tmp", "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                f.write(chunk)
+
+        os.replace(f"{archive}.tmp", archive)
+
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+
+def archive_extract(archive: Path, directory: str, changed: bool) -> None:
+    """
+    Extract an archive read from disk, if changed or anything in it is missing
+
+    :param archive: Archive
+    :type archive: Path
+    :param directory: Extract to
+    :type directory: str
+    :param changed: Downloaded again
+    :type changed: bool
+    """
+
+    with ZipFile(archive) as z:
+        if changed or not all((Path(directory) / _).exists() for _ in z.namelist()):
+            z.extractall(directory)
+
+
+def archives_get(years: Iterable[str], workers: int = DOWNLOAD_WORKERS) -> None:
+    """
+    Download the yearly archives of each filetype concurrently, conditional
+    on what was downloaded before, then extract them
+
+    :param years: Years
+    :type years: Iterable[str]
+    :param workers: Concurrent downloads, defaults to DOWNLOAD_WORKERS
+    :type workers: int, optional
+    """
+
+    os.makedirs(DOWNLOAD_DIRECTORY, exist_ok=True)
+
+    try:
+        with open(DOWNLOAD_STATE) as f:
+            states = json.load(f)
+    except (OSError, ValueError):
+        states = {}
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+    for scheme in ["http://", "https://"]:
+        session.mount(scheme, adapter)
+
+    archives = {
+        f"{DOWNLOAD_BASE}{filetype}_{year}.zip": filetype
+        for year in sorted(years)
+        for filetype in DOWNLOAD_FILETYPES
+    }
+    fetched: dict[str, Optional[dict]] = {}  # New state, None when unchanged
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                archive_fetch, session, url, DOWNLOAD_DIRECTORY, states.get(url, {})
+            ): url
+            for url in archives
+        }
+
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                fetched[url] = future.result()
+            except (requests.RequestException, OSError) as e:
+                logging.error(f"{url} not downloaded, {e}")
+
+    # One at a time and in year order, archives of a filetype share a directory
+    for url, filetype in archives.items():
+        if url not in fetched:
+            continue
+        state = fetched[url]
+        try:
+            archive_extract(
+                Path(DOWNLOAD_DIRECTORY) / url.split("/")[-1],
+                f"{DATA_DIRECTORY}/{filetype}",
+                state is not None,
+            )
+        except (BadZipFile, OSError) as e:
+            logging.error(f"{url} not extracted, {e}")
+            continue
+        if state is not None:
+            states[url] = state
+
+    with open(DOWNLOAD_STATE, "w") as f:
+        json.dump(states, f, indent=2)
+
+
+def get_data() -> None:
+    """
+    Fetch the data dictionaries and the yearly archives, archives only
+    where changed
+    """
 
     os.makedirs(DATA_DIRECTORY, exist_ok=True)
 
@@ -85,23 +711,7 @@ def get_data() -> None:
 
     # js postbacks etc so just extract the years and get the data statically
 
-    years = set(re.findall(r">(\d{4})", txt_base))
-
-    for year in years:
-
-        data = requests.get(
-            f"https://dadosabertos-download.cgu.gov.br/FalaBR/Arquivos_FalaBR/Pedidos_csv_{year}.zip"
-        ).content
-
-        z = ZipFile(io.BytesIO(data))
-        z.extractall(f"{DATA_DIRECTORY}/Pedidos_csv")
-
-        data = requests.get(
-            f"https://dadosabertos-download.cgu.gov.br/FalaBR/Arquivos_FalaBR/Recursos_Reclamacoes_csv_{year}.zip"
-        ).content
-
-        z = ZipFile(io.BytesIO(data))
-        z.extractall(f"{DATA_DIRECTORY}/Recursos_Reclamacoes_csv")
+    archives_get(set(re.findall(r">(\d{4})", txt_base)))
 
 
 def create_eda() -> None:
@@ -109,6 +719,12 @@ def create_eda() -> None:
     Create a oneliner EDA summary of data
     """
 
+    import pandas as pd
+    from pandas_profiling import ProfileReport
+    from tqdm import tqdm
+
+    pd.options.display.width = 0
+
     # If header file doesn't exist get data from website
 
     os.makedirs(DATA_DIRECTORY, exist_ok=True)
@@ -123,84 +739,24 @@ def create_eda() -> None:
             k.replace("-Formato.txt", ""): v for k, v in json.loads(f.read()).items()
         }
 
-    dfs: dict = {}
-
-    def dateparse(dates: list[str]) -> list[Optional[np.datetime64]]:
-        """
-        Forgiving parse list to date type list
-
-        :param dates: List of datetype strings
-        :type dates: list
-        :return: _description_
-        :rtype: list[Optional[datetime]]
-        """
-
-        dates_out: list[Optional[np.datetime64]] = []
-
-        for idx, dat in enumerate(dates):
-
-            date_bit = f"{dat[6:10]}-{dat[3:5]}-{dat[0:2]}"
-            time_bit = dat[11:] if dat[11:] else "00:00:00"
-
-            try:
-                # tz agnsotic at present though https://en.wikipedia.org/wiki/Time_in_Brazil
-                dates_out.append(np.datetime64(f"{date_bit}T{time_bit}"))
-            except ValueError:
-                dates_out.append(np.datetime64("NaT"))
-
-        return dates_out
-
-    latest = max(int(str(file)[-8:-4]) for file in Path(DATA_DIRECTORY).rglob("*.csv"))
+    # One scan, the latest year and the date prefix come from it too
+    files = sorted(Path(DATA_DIRECTORY).rglob("*.csv"))
 
-    for file in Path(DATA_DIRECTORY).rglob("*.csv"):
+    latest = max(int(str(file)[-8:-4]) for file in files)
+    date_str = files[-1].name[:8]
 
-        filename = (str(file).split("/"))[-1]
-
-        date_str = filename[:8]
-
-        for _ in headers_json.keys():
-
-            filetype = filename[9:].split("_")[0]
-
-            if re.search(f"^{_}", filetype):
-
-                dfs.setdefault(filetype, [])
-
-                names = [_["fieldname"] for _ in headers_json[_].values()]
-                dates = [
-                    _["fieldname"]
-                    for _ in headers_json[_].values()
-                    if _["format"][:5] == "Data "
-                ]
-
-                # Hack for some ragged columns not spec'd in data dictionary, or with delimiter not enclosed with quoting
-                # """names.extend(["ragged1", "ragged2", "ragged3"])""""
-                # Added warn
-                # For _Pedidos_csv  file pattern looks like data dictionary columns don't align with csv's
-
-                df = pd.read_csv(
-                    file,
-                    index_col=False,
-                    encoding="UTF-16",
-                    names=names,
-                    delimiter=";",
-                    on_bad_lines="warn",
-                    true_values=["Sim"],  # Grab these from locale or data dict?
-                    false_values=["Não"],
-                    parse_dates=dates,
-                    date_parser=dateparse,
-                )
-
-                df.replace(r"^\s*$", np.nan, regex=True, inplace=True)
+    dfs: dict = {}
 
-                dfs[filetype].append(df)
+    for filetype, frames in frames_read(
+        files, headers_json, cache=CACHE_DIRECTORY
+    ).items():
 
-                # Output latest year with most current changes
-                if int(str(file)[-8:-4]) == latest:
+        dfs[filetype] = [df for _, df in frames]
 
-                    filetype_yyyy = f"{filetype}_{str(file)[-8:-4]}"
-                    dfs.setdefault(filetype_yyyy, [])
-                    dfs[filetype_yyyy].append(df)
+        # Output latest year with most current changes
+        for file, df in frames:
+            if int(str(file)[-8:-4]) == latest:
+                dfs.setdefault(f"{filetype}_{latest}", []).append(df)
 
     docs_dir = f"{DATA_DIRECTORY}/docs"
 
@@ -210,7 +766,7 @@ def create_eda() -> None:
 
     for _ in tqdm(dfs):
 
-        df = pd.concat(dfs[_], ignore_index=True)
+        df = frames_concat(dfs[_])
         profile = ProfileReport(
             df,
             title=f"Profile report of {_}, date {date_str}",
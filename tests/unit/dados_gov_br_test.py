@@ -0,0 +1,311 @@
+import asyncio
+import csv
+import http.server
+import json
+import sys
+import threading
+from pathlib import Path
+from time import perf_counter
+
+import pytest
+import requests
+
+sys.argv[0] = "dados_gov_br.py"  # Read for its data directories on import
+sys.path.insert(0, str(Path(__file__).parents[2] / "scripts"))
+
+import dados_gov_br  # noqa: E402
+
+
+class SessionUnused(requests.Session):
+    def send(self, request, **kwargs):
+        raise AssertionError(f"Requested {request.url}")
+
+
+@pytest.fixture
+def breaker():
+    breaker = dados_gov_br.HostBreaker(failures=1)
+    breaker.failure("down.example")
+
+    return breaker
+
+
+def test_fetch_breaker_open_marks_row(breaker):
+    row = dados_gov_br.fetch(
+        SessionUnused(), "http://down.example/data.csv", "HEAD", breaker=breaker
+    )
+
+    assert row.method == dados_gov_br.REQUEST_BREAKER_METHOD
+    assert row["_method"] == dados_gov_br.REQUEST_BREAKER_METHOD
+    assert row.url == "http://down.example/data.csv"
+    assert row.status is None
+
+
+def test_fetch_breaker_open_other_host_requested(breaker):
+    with pytest.raises(AssertionError, match="up.example"):
+        dados_gov_br.fetch(
+            SessionUnused(), "http://up.example/data.csv", "HEAD", breaker=breaker
+        )
+
+
+def test_fetch_async_breaker_open_takes_no_token(breaker, tmp_path):
+    urls = [f"http://down.example/{_}.csv" for _ in range(20)]
+    file_output = tmp_path / "results.csv"
+
+    start = perf_counter()
+    count = asyncio.run(
+        dados_gov_br.fetch_async(
+            SessionUnused(),
+            urls,
+            "HEAD",
+            file_output=file_output,
+            limiter=dados_gov_br.HostLimiter(rate=1.0, burst=1),
+            breaker=breaker,
+        )
+    )
+
+    assert count == len(urls)
+    assert perf_counter() - start < 1.0  # A token a second would take 19s
+    with open(file_output) as f:
+        assert {row[9] for row in csv.reader(f)} == {
+            dados_gov_br.REQUEST_BREAKER_METHOD
+        }
+
+
+class SessionCounted(requests.Session):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def request(self, *args, **kwargs):
+        self.count += 1
+        return super().request(*args, **kwargs)
+
+
+def test_fetch_ftp_not_retried():
+    session = SessionCounted()
+    row = dados_gov_br.fetch(session, "ftp://ftp.example/data.csv", "HEAD")
+
+    assert session.count == 1
+    assert row.url == "ftp://ftp.example/data.csv"
+    assert row.status is None
+
+
+def test_fetch_final_error_releases_probe():
+    breaker = dados_gov_br.HostBreaker(failures=1, cooldown=0.0)
+    breaker.failure("ftp.example")
+
+    dados_gov_br.fetch(
+        requests.Session(), "ftp://ftp.example/data.csv", "HEAD", breaker=breaker
+    )
+
+    assert breaker.allow("ftp.example")  # The next url gets to probe
+
+
+def test_url_screen_http_only():
+    assert dados_gov_br.url_screen("http://dados.example/a/b.csv") is not None
+    assert dados_gov_br.url_screen("ftp://dados.example/a/b.csv") is None
+    assert dados_gov_br.url_screen("http:/a/b.csv") is None  # No host
+
+
+def test_result_row_fields_follow_response():
+    assert dados_gov_br.ResultRow._fields == tuple(
+        _[1:] if _ != "_bytes" else "bytes_" for _ in dados_gov_br.Response.__slots__
+    )
+
+
+def test_result_row_read_as_dict():
+    builder = dados_gov_br.ResponseBuilder()
+    builder.url("http://dados.example/a.csv")
+    builder.status(200)
+    row = builder.row()._replace(bytes_=10)
+
+    assert row[1] == row["_status"] == row.get("_status") == row.status == 200
+    assert row[:3] == (None, 200, "http://dados.example/a.csv")
+    assert row["_bytes"] == row.get("_bytes") == 10
+    assert row.get("missing", "default") == "default"
+    assert dict(zip(row.keys(), row)) == {
+        _: row[_] for _ in dados_gov_br.Response.__slots__
+    }
+
+
+@pytest.fixture
+def ftp_root(tmp_path):
+    servers = pytest.importorskip("pyftpdlib.servers")
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+
+    root = tmp_path / "ftp"
+    (root / "pub data").mkdir(parents=True)
+    for _ in ["plain.csv", "a b.csv", "ação.csv"]:
+        (root / "pub data" / _).write_text("id,value\n1,2\n")
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(str(root))
+    handler = type("Handler", (FTPHandler,), {"authorizer": authorizer})
+
+    server = servers.FTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f"ftp://127.0.0.1:{server.socket.getsockname()[1]}"
+
+    server.close_all()
+
+
+def test_ftp_check_percent_encoded_names(ftp_root, tmp_path):
+    uris = [
+        dados_gov_br.url_canonical(f"{ftp_root}/pub data/{_}")
+        for _ in ["plain.csv", "a b.csv", "ação.csv", "missing.csv"]
+    ]
+    assert "%20" in uris[1] and "%C3%A7" in uris[2]
+
+    file_output = tmp_path / "results.csv"
+    with dados_gov_br.FtpPool() as pool:
+        dados_gov_br.ftp_check(pool, uris, uris[0].rpartition("/")[0], file_output)
+
+    with open(file_output) as f:
+        statuses = {row[2]: (row[1], row[15]) for row in csv.reader(f)}
+
+    assert statuses == dict(zip(uris, [("200", "13")] * 3 + [("", "")]))
+
+
+JSON_DOCUMENT = (
+    '{"help": "x", "result": {"count": 3, "results": '
+    '[1.5, -2e10, 3E+2, 40, true, null, "ação", {"id": "a b", "n": [0.25]}] }}'
+)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, len(JSON_DOCUMENT.encode())])
+def test_json_items_chunk_splits(size):
+    data = JSON_DOCUMENT.encode()
+
+    for offset in range(size):
+        chunks = [data[:offset]] + [
+            data[_ : _ + size] for _ in range(offset, len(data), size)
+        ]
+        assert list(dados_gov_br.json_items(chunks, ("result", "results"))) == (
+            json.loads(JSON_DOCUMENT)["result"]["results"]
+        )
+
+
+@pytest.mark.parametrize(
+    "chunks, items",
+    [
+        ([b'{"result": [1.', b"5]}"], [1.5]),
+        ([b'{"result": [2e', b"10]}"], [2e10]),
+        ([b'{"result": [2', b"0, 3", b"]}"], [20, 3]),
+        ([b'{"result": [-', b"1 ", b", 3]}"], [-1, 3]),
+        ([b'{"other": 1}'], []),
+    ],
+)
+def test_json_items_numbers_split(chunks, items):
+    assert list(dados_gov_br.json_items(chunks, ("result",))) == items
+
+
+def test_csv_sink_journals_results_and_dicts(tmp_path):
+    builder = dados_gov_br.ResponseBuilder()
+    builder.url("http://dados.example/a.csv")
+    checkpoint = dados_gov_br.Checkpoint(tmp_path / "results.csv.journal")
+
+    with dados_gov_br.CsvSink(
+        tmp_path / "results.csv",
+        dados_gov_br.Response.__slots__,
+        header=True,
+        seconds=None,
+        checkpoint=checkpoint,
+    ) as sink:
+        sink.write(builder.row())
+        sink.write({"_url": "http://dados.example/b.csv", "_status": "200"})
+
+    assert (tmp_path / "results.csv.journal").read_text().split() == [
+        "http://dados.example/a.csv",
+        "http://dados.example/b.csv",
+    ]
+    with open(tmp_path / "results.csv") as f:
+        assert [_["_url"] for _ in csv.DictReader(f)] == [
+            "http://dados.example/a.csv",
+            "http://dados.example/b.csv",
+        ]
+
+
+class SniffHandler(http.server.BaseHTTPRequestHandler):
+    BODY = b"%PDF-1.4 leading bytes"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        if self.headers.get("If-None-Match"):
+            self.send_response(304)
+        elif self.path == "/refused.pdf":
+            self.send_response(405)
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        body = b'{"result": {}}' if self.path == "/api" else self.BODY
+        self.send_response(200 if self.path == "/api" else 206)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope="module")
+def http_base():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SniffHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+
+
+def test_fetch_sniff_keeps_head_status(http_base):
+    row = dados_gov_br.fetch(
+        requests.Session(), f"{http_base}/generic.pdf", "HEAD", sniff=True
+    )
+
+    assert (row.status, row.method) == (200, "HEAD")
+    assert row.mime_type_sniffed == "application/pdf"
+
+
+def test_fetch_sniff_refused_head_not_partial(http_base):
+    row = dados_gov_br.fetch(
+        requests.Session(), f"{http_base}/refused.pdf", "HEAD", sniff=True
+    )
+
+    assert (row.status, row.method) == (200, "GET")
+    assert row.mime_type_sniffed == "application/pdf"
+
+
+def test_fetch_api_body_not_sniffed(http_base):
+    row = dados_gov_br.fetch(
+        requests.Session(), f"{http_base}/api", "GET", resource=False
+    )
+
+    assert row.content == b'{"result": {}}'
+    assert row.mime_type_sniffed is None
+
+
+def test_fetch_not_modified_row_typed(http_base):
+    previous = dict.fromkeys(dados_gov_br.Response.__slots__, "")
+    previous.update(
+        {
+            "_status": "200",
+            "_url": f"{http_base}/data.csv",
+            "_etag": '"v1"',
+            "_method": "HEAD",
+            "_time_total": "0.5",
+            "_bytes": "10",
+        }
+    )
+
+    row = dados_gov_br.fetch(
+        requests.Session(), f"{http_base}/data.csv", "HEAD", previous=previous
+    )
+
+    assert row.status == 200 and row.etag == '"v1"' and row.method == "HEAD"
+    assert row.content is None and row.encoding is None
+    assert row.bytes_ == 0 and isinstance(row.time_total, float)
@@ -0,0 +1,142 @@
+import sys
+from pathlib import Path
+from time import sleep
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.argv[0] = "falabr_cgu_gov_br.py"  # Read for its data directories on import
+sys.path.insert(0, str(Path(__file__).parents[2] / "scripts"))
+
+import falabr_cgu_gov_br  # noqa: E402
+
+DATES = [
+    "01/02/2020",
+    "01/02/2020 10:30:15",
+    "31/12/2021 23:59:59",
+    "29/02/2020",
+    "29/02/2021",
+    "29/02/1900",
+    "29/02/2000 12:00:00",
+    "31/04/2021",
+    "00/01/2021",
+    "32/01/2021",
+    "01/00/2021",
+    "01/13/2021",
+    "01/02/2020 24:00:00",
+    "01/02/2020 23:60:00",
+    "01/02/2020 23:59:60",
+    "01/02/1600",
+    "01/02/2300 10:30:15",
+    "01/02/2020 10:30",
+    "01/02/2020 1:30",
+    "01/02/2020 10:30:1",
+    "01/02/2020 ",
+    "01/02/2020 10:30:15 ",
+    "01/02/2020  ",
+    "",
+    " ",
+    "01-02-2020",
+    "01.02.2020 10.30.15",
+    "1/2/2020",
+    "2020-02-01",
+    "01/02/20",
+    "ab/cd/efgh",
+    "01/02/2020T10:30:15",
+    "01/02/2020 10:30:15.5",
+]
+
+
+def dateparse(dates):
+    # As read_csv made of the forgiving parse dates_parse took over from
+    dates_out = []
+    for dat in dates:
+        date_bit = f"{dat[6:10]}-{dat[3:5]}-{dat[0:2]}"
+        time_bit = dat[11:] if dat[11:] else "00:00:00"
+        try:
+            dates_out.append(np.datetime64(f"{date_bit}T{time_bit}"))
+        except ValueError:
+            dates_out.append(np.datetime64("NaT"))
+
+    return pd.DatetimeIndex(
+        pd.to_datetime(pd.Series(dates_out, dtype=object), errors="coerce")
+    )
+
+
+@pytest.mark.parametrize("date", DATES)
+def test_dates_parse_matches_dateparse(date):
+    pd.testing.assert_index_equal(
+        falabr_cgu_gov_br.dates_parse([date]), dateparse([date])
+    )
+
+
+def test_dates_parse_matches_dateparse_repeated():
+    dates = DATES + DATES[::-1] + DATES
+
+    pd.testing.assert_index_equal(
+        falabr_cgu_gov_br.dates_parse(dates), dateparse(dates)
+    )
+
+
+@pytest.fixture
+def data_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(falabr_cgu_gov_br, "DATA_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(
+        falabr_cgu_gov_br, "DOWNLOAD_DIRECTORY", str(tmp_path / "archives")
+    )
+    monkeypatch.setattr(
+        falabr_cgu_gov_br, "DOWNLOAD_STATE", str(tmp_path / "downloads.json")
+    )
+
+    return tmp_path
+
+
+def test_archives_get_extracts_one_at_a_time_in_year_order(data_directory, monkeypatch):
+    extracting = []
+    extracted = []
+
+    def archive_fetch(session, url, directory, state):
+        name = url.split("/")[-1]
+        with ZipFile(Path(directory) / name, "w") as z:
+            z.writestr("shared.csv", name)
+
+        return {"etag": name, "last_modified": None}
+
+    def archive_extract(archive, directory, changed):
+        extracting.append(archive.name)
+        sleep(0.01)
+        assert extracting == [archive.name]
+        extract(archive, directory, changed)
+        extracting.remove(archive.name)
+        extracted.append(archive.name)
+
+    extract = falabr_cgu_gov_br.archive_extract
+    monkeypatch.setattr(falabr_cgu_gov_br, "archive_fetch", archive_fetch)
+    monkeypatch.setattr(falabr_cgu_gov_br, "archive_extract", archive_extract)
+
+    falabr_cgu_gov_br.archives_get(["2022", "2021", "2023"], workers=6)
+
+    assert extracted == [
+        f"{filetype}_{year}.zip"
+        for year in ["2021", "2022", "2023"]
+        for filetype in falabr_cgu_gov_br.DOWNLOAD_FILETYPES
+    ]
+    for filetype in falabr_cgu_gov_br.DOWNLOAD_FILETYPES:
+        shared = data_directory / filetype / "shared.csv"
+        assert shared.read_text() == f"{filetype}_2023.zip"
+
+
+def test_archives_get_bad_archive_state_kept(data_directory, monkeypatch):
+    def archive_fetch(session, url, directory, state):
+        name = url.split("/")[-1]
+        (Path(directory) / name).write_text("not a zip")
+
+        return {"etag": name, "last_modified": None}
+
+    monkeypatch.setattr(falabr_cgu_gov_br, "archive_fetch", archive_fetch)
+
+    falabr_cgu_gov_br.archives_get(["2021"])
+
+    assert (data_directory / "downloads.json").read_text() == "{}"